@@ -1,7 +1,7 @@
 // ==UserScript==
 // @name         LMArena API Bridge
 // @namespace    http://tampermonkey.net/
-// @version      2.5
+// @version      2.9
 // @description  Bridges LMArena to a local API server via WebSocket for streamlined automation.
 // @author       Lianues
 // @match        https://lmarena.ai/*
@@ -16,13 +16,26 @@
 
     // --- 配置 ---
     const SERVER_URL = "ws://localhost:5102/ws"; // 与 api_server.py 中的端口匹配
+    const MAX_CONCURRENT_REQUESTS = 4; // 单个标签页同时进行的生成数，超出的请求在本地排队
+    const SCRIPT_VERSION = '2.9';
+    const PROTOCOL_VERSION = 2; // 与 bridge/protocol.py 一致
+    const CHUNK_COALESCE_MS = 10; // 紧凑帧模式下，同一请求在该时间内的数据块合并为一帧
     let socket;
+    let serverProtocol = 1; // 握手前按旧协议（JSON）发送
     let isCaptureModeActive = false; // ID捕获模式的开关
 
+    // 脚本自己发起的 fetch 在 init 上带这个标记，拦截器据此跳过 ID 捕获
+    const BRIDGE_REQUEST = Symbol('apiBridgeRequest');
+    // request_id -> { controller, queuedAt, startedAt, firstByteAt }
+    const inflight = new Map();
+    // 等待执行的请求 [{ requestId, payload, queuedAt }]
+    const pendingQueue = [];
+
     // --- 核心逻辑 ---
     function connect() {
         console.log(`[API Bridge] 正在连接到本地服务器: ${SERVER_URL}...`);
         socket = new WebSocket(SERVER_URL);
+        serverProtocol = 1;
 
         socket.onopen = () => {
             console.log("[API Bridge] ✅ 与本地服务器的 WebSocket 连接已建立。");
@@ -36,7 +49,16 @@
                 // 检查是否是指令，而不是标准的聊天请求
                 if (message.command) {
                     console.log(`[API Bridge] ⬇️ 收到指令: ${message.command}`);
-                    if (message.command === 'refresh' || message.command === 'reconnect') {
+                    if (message.command === 'hello') {
+                        serverProtocol = Math.min(message.protocol || 1, PROTOCOL_VERSION);
+                        socket.send(JSON.stringify({
+                            type: 'hello',
+                            protocol: PROTOCOL_VERSION,
+                            version: SCRIPT_VERSION,
+                            max_concurrency: MAX_CONCURRENT_REQUESTS,
+                        }));
+                        console.log(`[API Bridge] 握手完成，使用协议 ${serverProtocol}。`);
+                    } else if (message.command === 'refresh' || message.command === 'reconnect') {
                         console.log(`[API Bridge] 收到 '${message.command}' 指令，正在执行页面刷新...`);
                         location.reload();
                     } else if (message.command === 'activate_id_capture') {
@@ -45,8 +67,10 @@
                         // 可以选择性地给用户一个视觉提示
                         document.title = "🎯 " + document.title;
                     } else if (message.command === 'send_page_source') {
-                       console.log("[API Bridge] 收到发送页面源码的指令，正在发送...");
-                       sendPageSource();
+                       console.log("[API Bridge] 收到同步模型列表的指令...");
+                       syncModels(message.models_digest);
+                    } else if (message.command === 'cancel') {
+                        cancelRequest(message.request_id, message.reason || '后端取消');
                     }
                     return;
                 }
@@ -58,8 +82,8 @@
                     return;
                 }
                 
-                console.log(`[API Bridge] ⬇️ 收到聊天请求 ${request_id.substring(0, 8)}。准备执行 fetch 操作。`);
-                await executeFetchAndStreamBack(request_id, payload);
+                console.log(`[API Bridge] ⬇️ 收到聊天请求 ${request_id.substring(0, 8)}。`);
+                enqueueRequest(request_id, payload);
 
             } catch (error) {
                 console.error("[API Bridge] 处理服务器消息时出错:", error);
@@ -68,6 +92,9 @@
 
         socket.onclose = () => {
             console.warn("[API Bridge] 🔌 与本地服务器的连接已断开。将在5秒后尝试重新连接...");
+            // 后端会让这些请求失败，不必再占用 LMArena 的连接
+            abortAll("WebSocket 连接已断开");
+            pendingChunks.clear();
             if (document.title.startsWith("✅ ")) {
                 document.title = document.title.substring(2);
             }
@@ -80,7 +107,67 @@
         };
     }
 
-    async function executeFetchAndStreamBack(requestId, payload) {
+    // --- 请求调度 ---
+    function enqueueRequest(requestId, payload) {
+        if (inflight.has(requestId) || pendingQueue.some(item => item.requestId === requestId)) {
+            console.warn(`[API Bridge] 请求 ${requestId.substring(0, 8)} 已在处理中，忽略重复请求。`);
+            return;
+        }
+        pendingQueue.push({ requestId, payload, queuedAt: performance.now() });
+        if (inflight.size >= MAX_CONCURRENT_REQUESTS) {
+            console.log(`[API Bridge] 并发已满 (${inflight.size}/${MAX_CONCURRENT_REQUESTS})，请求 ${requestId.substring(0, 8)} 排队中 (${pendingQueue.length})。`);
+        }
+        drainQueue();
+    }
+
+    function drainQueue() {
+        while (inflight.size < MAX_CONCURRENT_REQUESTS && pendingQueue.length > 0) {
+            const { requestId, payload, queuedAt } = pendingQueue.shift();
+            const state = { controller: new AbortController(), queuedAt, startedAt: performance.now(), firstByteAt: null };
+            inflight.set(requestId, state);
+            executeFetchAndStreamBack(requestId, payload, state).finally(() => {
+                inflight.delete(requestId);
+                drainQueue();
+            });
+        }
+    }
+
+    // 后端已放弃该请求（客户端断开或超时），排队中的直接移除，执行中的中止上游请求
+    function cancelRequest(requestId, reason) {
+        const index = pendingQueue.findIndex(item => item.requestId === requestId);
+        if (index !== -1) {
+            pendingQueue.splice(index, 1);
+            console.log(`[API Bridge] ⏹️ 排队中的请求 ${requestId.substring(0, 8)} 已取消: ${reason}`);
+            sendToServer(requestId, "[DONE]");
+            return;
+        }
+        const state = inflight.get(requestId);
+        if (state) {
+            state.controller.abort(reason);
+        }
+    }
+
+    function abortAll(reason) {
+        pendingQueue.length = 0;
+        for (const state of inflight.values()) {
+            state.controller.abort(reason);
+        }
+    }
+
+    // 把单个请求的耗时报告给后端（毫秒）
+    function reportTiming(requestId, state, ok) {
+        const now = performance.now();
+        sendToServer(requestId, {
+            timing: {
+                queued_ms: Math.round(state.startedAt - state.queuedAt),
+                ttfb_ms: state.firstByteAt === null ? null : Math.round(state.firstByteAt - state.startedAt),
+                total_ms: Math.round(now - state.startedAt),
+                ok,
+            }
+        });
+    }
+
+    async function executeFetchAndStreamBack(requestId, payload, state) {
         console.log(`[API Bridge] 当前操作域名: ${window.location.hostname}`);
         const { is_image_request, message_templates, target_model_id, session_id, message_id } = payload;
 
@@ -145,8 +232,7 @@
 
         console.log("[API Bridge] 准备发送到 LMArena API 的最终载荷:", JSON.stringify(body, null, 2));
 
-        // 设置一个标志，让我们的 fetch 拦截器知道这个请求是脚本自己发起的
-        window.isApiBridgeRequest = true;
+        let ok = false;
         try {
             const response = await fetch(apiUrl, {
                 method: httpMethod,
@@ -155,7 +241,10 @@
                     'Accept': '*/*',
                 },
                 body: JSON.stringify(body),
-                credentials: 'include' // 必须包含 cookie
+                credentials: 'include', // 必须包含 cookie
+                signal: state.controller.signal,
+                // 让 fetch 拦截器知道这个请求是脚本自己发起的
+                [BRIDGE_REQUEST]: true,
             });
 
             if (!response.ok || !response.body) {
@@ -168,36 +257,78 @@
 
             while (true) {
                 const { value, done } = await reader.read();
+                if (state.firstByteAt === null) state.firstByteAt = performance.now();
                 if (done) {
                     console.log(`[API Bridge] ✅ 请求 ${requestId.substring(0, 8)} 的流已结束。`);
-                    sendToServer(requestId, "[DONE]");
+                    const tail = decoder.decode();
+                    if (tail) sendToServer(requestId, tail);
+                    ok = true;
                     break;
                 }
-                const chunk = decoder.decode(value);
+                const chunk = decoder.decode(value, { stream: true });
                 // 直接将原始数据块转发回后端
-                sendToServer(requestId, chunk);
+                if (chunk) sendToServer(requestId, chunk);
             }
 
         } catch (error) {
-            console.error(`[API Bridge] ❌ 在为请求 ${requestId.substring(0, 8)} 执行 fetch 时出错:`, error);
+            if (state.controller.signal.aborted) {
+                console.warn(`[API Bridge] ⏹️ 请求 ${requestId.substring(0, 8)} 已中止: ${state.controller.signal.reason}`);
+            } else {
+                console.error(`[API Bridge] ❌ 在为请求 ${requestId.substring(0, 8)} 执行 fetch 时出错:`, error);
+            }
             sendToServer(requestId, { error: error.message });
-            sendToServer(requestId, "[DONE]");
-        } finally {
-            // 请求结束后，无论成功与否，都重置标志
-            window.isApiBridgeRequest = false;
+        }
+        reportTiming(requestId, state, ok);
+        sendToServer(requestId, "[DONE]");
+    }
+
+    // request_id -> 尚未发出的数据块，仅紧凑帧模式使用
+    const pendingChunks = new Map();
+    let chunkFlushTimer = null;
+
+    function flushChunks(requestId) {
+        const parts = pendingChunks.get(requestId);
+        if (!parts) return;
+        pendingChunks.delete(requestId);
+        socket.send('d' + requestId + parts.join(''));
+    }
+
+    function flushAllChunks() {
+        chunkFlushTimer = null;
+        if (!socket || socket.readyState !== WebSocket.OPEN) {
+            pendingChunks.clear();
+            return;
+        }
+        for (const requestId of Array.from(pendingChunks.keys())) {
+            flushChunks(requestId);
         }
     }
 
     function sendToServer(requestId, data) {
-        if (socket && socket.readyState === WebSocket.OPEN) {
-            const message = {
-                request_id: requestId,
-                data: data
-            };
-            socket.send(JSON.stringify(message));
-        } else {
+        if (!socket || socket.readyState !== WebSocket.OPEN) {
             console.error("[API Bridge] 无法发送数据，WebSocket 连接未打开。");
+            return;
+        }
+        const isChunk = typeof data === 'string' && data !== '[DONE]';
+        const isError = data !== null && typeof data === 'object' && 'error' in data;
+        if (serverProtocol < 2 || !(isChunk || isError || data === '[DONE]')) {
+            // 旧协议或控制消息（耗时报告等）：JSON，先发出已缓冲的数据块以保证顺序
+            if (pendingChunks.has(requestId)) flushChunks(requestId);
+            socket.send(JSON.stringify({ request_id: requestId, data: data }));
+            return;
         }
+        if (isChunk) {
+            // 紧凑帧：<类型><request_id><内容>，数据块按请求合并后定时发出
+            const parts = pendingChunks.get(requestId);
+            if (parts) parts.push(data);
+            else pendingChunks.set(requestId, [data]);
+            if (chunkFlushTimer === null) {
+                chunkFlushTimer = setTimeout(flushAllChunks, CHUNK_COALESCE_MS);
+            }
+            return;
+        }
+        if (pendingChunks.has(requestId)) flushChunks(requestId);
+        socket.send(isError ? 'e' + requestId + data.error : 'f' + requestId);
     }
 
     // --- 网络请求拦截 ---
@@ -220,7 +351,8 @@
             const match = urlString.match(/\/nextjs-api\/stream\/retry-evaluation-session-message\/([a-f0-9-]+)\/messages\/([a-f0-9-]+)/);
 
             // 仅在请求不是由API桥自身发起，且捕获模式已激活时，才更新ID
-            if (match && !window.isApiBridgeRequest && isCaptureModeActive) {
+            const isBridgeRequest = Boolean(args[1] && args[1][BRIDGE_REQUEST]);
+            if (match && !isBridgeRequest && isCaptureModeActive) {
                 const sessionId = match[1];
                 const messageId = match[2];
 
@@ -255,11 +387,109 @@
     };
 
 
+    // --- 模型列表同步 ---
+    const MODELS_ENDPOINT = 'http://localhost:5102/internal/update_available_models';
+
+    // 从 Next.js 的 flight 数据中提取模型对象（与后端 bridge/models.py 的规则一致）
+    function extractModels() {
+        const chunks = self.__next_f;
+        if (!Array.isArray(chunks)) return null;
+        const text = chunks
+            .filter(c => Array.isArray(c) && typeof c[1] === 'string')
+            .map(c => c[1])
+            .join('');
+        const models = [];
+        const names = new Set();
+        const startRe = /\{"id":"[a-f0-9-]+"/g;
+        let consumed = 0;
+        let match;
+        while ((match = startRe.exec(text)) !== null) {
+            const start = match.index;
+            if (start < consumed) continue;
+            let depth = 0;
+            let end = -1;
+            const limit = Math.min(text.length, start + 10000);
+            for (let i = start; i < limit; i++) {
+                const ch = text[i];
+                if (ch === '{') depth++;
+                else if (ch === '}' && --depth === 0) { end = i + 1; break; }
+            }
+            if (end === -1) continue;
+            let obj;
+            try {
+                obj = JSON.parse(text.slice(start, end));
+            } catch (e) {
+                continue;
+            }
+            consumed = end;
+            const stack = [obj];
+            while (stack.length) {
+                const cur = stack.pop();
+                if (Array.isArray(cur)) {
+                    for (let i = cur.length - 1; i >= 0; i--) stack.push(cur[i]);
+                } else if (cur && typeof cur === 'object') {
+                    if (Object.keys(cur)[0] === 'id' && /^[a-f0-9-]+$/.test(cur.id)
+                        && cur.publicName && !names.has(cur.publicName)) {
+                        names.add(cur.publicName);
+                        models.push(cur);
+                    }
+                    const values = Object.values(cur);
+                    for (let i = values.length - 1; i >= 0; i--) stack.push(values[i]);
+                }
+            }
+        }
+        return models;
+    }
+
+    function modelType(model) {
+        const caps = (model.capabilities && model.capabilities.outputCapabilities) || {};
+        return ['video', 'image', 'search', 'text'].find(t => caps[t]) || 'unknown';
+    }
+
+    // 模型集合摘要：排序后的 "id:publicName:type" 行的 sha256
+    async function modelsDigest(models) {
+        const lines = models.map(m => `${m.id}:${m.publicName}:${modelType(m)}`).sort();
+        const buf = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(lines.join('\n')));
+        return Array.from(new Uint8Array(buf)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function gzip(text) {
+        const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+        return await new Response(stream).blob();
+    }
+
+    async function syncModels(serverDigest) {
+        try {
+            const models = extractModels();
+            if (!models || models.length === 0) {
+                // 页面结构变化或数据尚未加载，退回发送整个页面
+                await sendPageSource();
+                return;
+            }
+            const digest = await modelsDigest(models);
+            if (digest === serverDigest) {
+                console.log(`[API Bridge] 模型列表未变化 (${models.length} 个)，无需同步。`);
+                return;
+            }
+            const json = JSON.stringify(models);
+            const headers = { 'Content-Type': 'application/json', 'X-Models-Digest': digest };
+            let body = json;
+            if (typeof CompressionStream !== 'undefined') {
+                body = await gzip(json);
+                headers['Content-Encoding'] = 'gzip';
+            }
+            await fetch(MODELS_ENDPOINT, { method: 'POST', headers, body });
+            console.log(`[API Bridge] 模型列表已同步 (${models.length} 个)。`);
+        } catch (e) {
+            console.error("[API Bridge] 同步模型列表失败:", e);
+        }
+    }
+
     // --- 页面源码发送 ---
     async function sendPageSource() {
         try {
             const htmlContent = document.documentElement.outerHTML;
-            await fetch('http://localhost:5102/internal/update_available_models', { // 新的端点
+            await fetch(MODELS_ENDPOINT, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'text/html; charset=utf-8'
@@ -274,7 +504,7 @@
 
     // --- 启动连接 ---
     console.log("========================================");
-    console.log("  LMArena API Bridge v2.5 正在运行。");
+    console.log("  LMArena API Bridge v2.9 正在运行。");
     console.log("  - 聊天功能已连接到 ws://localhost:5102");
     console.log("  - ID 捕获器将发送到 http://localhost:5103");
     console.log("========================================");
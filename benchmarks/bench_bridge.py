@@ -0,0 +1,237 @@
+"""
+桥梁服务器离线压测：内置 FastAPIWrapper + LMArenaBridgeServer，
+由若干虚拟油猴脚本回放数据流，测量不同并发下的吞吐、延迟和内存。
+
+用法（在插件根目录下）:
+    python -m benchmarks.bench_bridge --concurrency 1 10 50 100 500 --tabs 4
+    python -m benchmarks.bench_bridge --stream --recording path/to/stream.txt
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import socket
+import statistics
+import time
+from pathlib import Path
+
+import aiohttp
+
+from bridge.server import FastAPIWrapper, LMArenaBridgeServer
+
+from .virtual_client import VirtualUserscript, synthetic_stream
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "_conf_schema.json"
+
+
+class BenchConfig(dict):
+    """以 _conf_schema.json 默认值构建的配置，save_config 不落盘"""
+
+    def __init__(self, overrides: dict):
+        super().__init__(self._defaults(json.loads(SCHEMA_PATH.read_text("utf-8"))))
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(self.get(key), dict):
+                self[key].update(value)
+            else:
+                self[key] = value
+
+    @classmethod
+    def _defaults(cls, schema: dict) -> dict:
+        conf = {}
+        for key, item in schema.items():
+            if item.get("type") == "object":
+                conf[key] = cls._defaults(item.get("items", {}))
+            else:
+                conf[key] = item.get("default")
+        return conf
+
+    def save_config(self):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb() -> float:
+    """当前常驻内存（MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def wait_for_workers(server: LMArenaBridgeServer, count: int, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while len(server.workers) < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError("虚拟标签页未能全部连接")
+        await asyncio.sleep(0.05)
+
+
+async def run_level(
+    http: aiohttp.ClientSession,
+    url: str,
+    concurrency: int,
+    total: int,
+    stream: bool,
+) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+    rejected = 0
+    body = {"messages": [{"role": "user", "content": "bench"}], "stream": stream}
+
+    async def one():
+        nonlocal errors, rejected
+        async with sem:
+            start = time.perf_counter()
+            try:
+                async with http.post(url, json=body) as resp:
+                    await resp.read()
+                    if resp.status == 429:
+                        rejected += 1
+                        return
+                    if resp.status != 200:
+                        errors += 1
+                        return
+            except aiohttp.ClientError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        if not latencies:
+            return float("nan")
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "rejected": rejected,
+        "rps": total / elapsed,
+        "p50_ms": pct(0.50),
+        "p99_ms": pct(0.99),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+        "rss_mb": rss_mb(),
+        "rss_delta_mb": rss_mb() - rss_before,
+    }
+
+
+async def main_async(args):
+    port = free_port()
+    overrides = {}
+    if args.max_inflight is not None:
+        overrides["max_inflight_per_browser"] = args.max_inflight
+    conf = BenchConfig(
+        {
+            **overrides,
+            "timeout": args.timeout,
+            "session_pool": [f"bench-session-{i}:bench-msg-{i}" for i in range(8)],
+            "session_max_concurrency": 0,
+            "bridge_server": {"host": "127.0.0.1", "port": port, "api_key": ""},
+        }
+    )
+    server = LMArenaBridgeServer(conf)  # type: ignore
+    api = FastAPIWrapper(server, conf)  # type: ignore
+    api.start()
+
+    stream = (
+        Path(args.recording).read_text("utf-8")
+        if args.recording
+        else synthetic_stream(args.tokens)
+    )
+    tabs = [
+        VirtualUserscript(
+            f"ws://127.0.0.1:{port}/ws",
+            stream=stream,
+            chunk_size=args.chunk_size,
+            ttfb=args.ttfb,
+            chunk_delay=args.chunk_delay,
+            failure_rate=args.failure_rate,
+            seed=i,
+            compact=not args.legacy_protocol,
+        )
+        for i in range(args.tabs)
+    ]
+    for _ in range(100):
+        try:
+            await asyncio.gather(*(tab.start() for tab in tabs))
+            break
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+    await wait_for_workers(server, len(tabs))
+
+    url = f"http://127.0.0.1:{port}/v1/chat/completions"
+    results = []
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        for concurrency in args.concurrency:
+            total = max(concurrency * args.rounds, args.min_requests)
+            results.append(await run_level(http, url, concurrency, total, args.stream))
+
+    await asyncio.gather(*(tab.stop() for tab in tabs))
+    api.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 500]
+    )
+    parser.add_argument("--tabs", type=int, default=4, help="虚拟标签页数量")
+    parser.add_argument("--rounds", type=int, default=4, help="每个并发档位的轮数")
+    parser.add_argument("--min-requests", type=int, default=50)
+    parser.add_argument("--stream", action="store_true", help="使用 SSE 流式响应")
+    parser.add_argument("--recording", help="回放录制的原始数据流文件")
+    parser.add_argument("--tokens", type=int, default=50, help="合成数据流的文本帧数")
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument(
+        "--legacy-protocol", action="store_true", help="虚拟标签页使用旧版 JSON 消息"
+    )
+    parser.add_argument("--ttfb", type=float, default=0.05)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument(
+        "--max-inflight", type=int, help="单标签页在途上限，默认取配置默认值"
+    )
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--verbose", action="store_true", help="显示桥梁日志")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("astrbot").setLevel(logging.WARNING)
+    results = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        f"{'并发':>6} {'请求数':>8} {'错误':>6} {'429':>6} {'req/s':>9} "
+        f"{'p50(ms)':>9} {'p99(ms)':>9} {'RSS(MB)':>9} {'ΔRSS':>7}"
+    )
+    for r in results:
+        print(
+            f"{r['concurrency']:>6} {r['requests']:>8} {r['errors']:>6} "
+            f"{r['rejected']:>6} "
+            f"{r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+            f"{r['rss_mb']:>9.1f} {r['rss_delta_mb']:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+图片压缩基准：旧版逐步降质量/缩放循环 vs 体积模型 + 二分查找
+
+用法（在插件根目录下）:
+    python -m benchmarks.bench_compress [--limit-kb 500 1500] [--format jpeg webp]
+    python -m benchmarks.bench_compress --images a.jpg b.png
+"""
+
+import argparse
+import io
+import random
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from imaging import compress_sync
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> bytes:
+    """生成带噪声和渐变、接近照片编码难度的高质量 JPEG"""
+    rnd = random.Random(seed)
+    img = Image.effect_noise((width, height), 120).convert("RGB")
+    draw = ImageDraw.Draw(img, "RGBA")
+    for _ in range(60):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        r = rnd.randrange(width // 20, width // 4)
+        color = tuple(rnd.randrange(256) for _ in range(3)) + (140,)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def legacy_compress(image_bytes: bytes, max_bytes: int, fix_tell: bool):
+    """
+    重构前 workflow.compress_image 的逻辑。返回 (结果, 编码次数)。
+    fix_tell=False 时保留原有 bug：seek(0) 之后读取 tell()，首轮结果总被当作达标。
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == "GIF" or len(image_bytes) <= max_bytes:
+        return image_bytes, 0
+    encodes = 0
+    img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+    resampled = io.BytesIO()
+    img.save(resampled, format=img.format, quality=70, optimize=True)
+    encodes += 1
+    size = resampled.tell()
+    resampled.seek(0)
+    if (resampled.tell() if not fix_tell else size) <= max_bytes:
+        return resampled.getvalue(), encodes
+
+    quality, scale = 50, 0.6
+    while True:
+        resampled.seek(0)
+        resampled.truncate(0)
+        if scale < 1:
+            w, h = img.size
+            tmp = img.resize((int(w * scale), int(h * scale)), Image.Resampling.LANCZOS)
+        else:
+            tmp = img
+        tmp.save(resampled, format=img.format, quality=quality, optimize=True)
+        encodes += 1
+        if resampled.tell() <= max_bytes or (quality <= 5 and scale <= 0.2):
+            break
+        if quality > 5:
+            quality -= 5
+        else:
+            scale *= 0.9
+    return resampled.getvalue(), encodes
+
+
+def run(name, func, images, max_bytes, repeat):
+    total_time = 0.0
+    total_encodes = 0
+    over = 0
+    sizes = []
+    sides = []
+    for data in images:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out, encodes = func(data, max_bytes)
+            best = min(best, time.perf_counter() - start)
+        total_time += best
+        total_encodes += encodes
+        sizes.append(len(out))
+        sides.append(max(Image.open(io.BytesIO(out)).size))
+        over += len(out) > max_bytes
+    n = len(images)
+    print(
+        f"{name:<22} {total_encodes / n:>8.1f} {total_time / n * 1000:>10.1f} "
+        f"{sum(sizes) / n / 1024:>10.0f} {sum(sides) / n:>8.0f} {over:>6}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", nargs="*", help="使用真实图片代替合成图片")
+    parser.add_argument("--count", type=int, default=4, help="合成图片数量")
+    parser.add_argument("--size", default="4000x3000", help="合成图片尺寸")
+    parser.add_argument("--limit-kb", type=int, nargs="+", default=[100, 500, 3000])
+    parser.add_argument("--format", nargs="+", default=["jpeg", "webp"])
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [Path(p).read_bytes() for p in args.images]
+    else:
+        w, h = map(int, args.size.split("x"))
+        images = [synthetic_photo(w, h, seed) for seed in range(args.count)]
+    avg_kb = sum(len(d) for d in images) / len(images) / 1024
+    print(f"{len(images)} 张图片，平均 {avg_kb:.0f}KB")
+
+    for limit_kb in args.limit_kb:
+        max_bytes = limit_kb * 1024
+        print(f"\n上限 {limit_kb}KB")
+        print(
+            f"{'方案':<22} {'编码次数':>8} {'耗时(ms)':>10} {'结果(KB)':>10} {'长边':>8} {'超限':>6}"
+        )
+        run(
+            "旧版(原样)",
+            lambda d, m: legacy_compress(d, m, fix_tell=False),
+            images,
+            max_bytes,
+            args.repeat,
+        )
+        run(
+            "旧版(修正 tell)",
+            lambda d, m: legacy_compress(d, m, fix_tell=True),
+            images,
+            max_bytes,
+            args.repeat,
+        )
+        for fmt in args.format:
+            run(
+                f"新版({fmt})",
+                lambda d, m, fmt=fmt: compress_sync(d, m, fmt),
+                images,
+                max_bytes,
+                args.repeat,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+模型列表提取基准：单遍提取器 vs 旧版逐字符括号匹配
+
+用法（在插件根目录下）:
+    python -m benchmarks.bench_models [--padding-kb 2000] [--repeat 5]
+    python -m benchmarks.bench_models --html saved_page.html
+
+真实页面可在 lmarena.ai 的浏览器控制台中执行
+copy(document.documentElement.outerHTML) 后粘贴保存。
+"""
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+from bridge.models import extract_models
+
+MODELS_PATH = Path(__file__).parent.parent / "bridge" / "available_models.json"
+
+
+def synthetic_page(padding_kb: int, copies: int = 3) -> str:
+    """
+    用 available_models.json 拼出与 lmarena.ai 相似的页面：
+    模型列表以转义 JSON 的形式放在 Next.js 的 self.__next_f.push 脚本中，
+    同一列表在页面里出现多次（首屏数据 + 各组件），其余为填充的标签
+    """
+    models = json.loads(MODELS_PATH.read_text(encoding="utf-8"))
+    compact = json.dumps({"initialModels": models}, separators=(",", ":"))
+    escaped = json.dumps(compact)[1:-1]
+    script = f'<script>self.__next_f.push([1,"{escaped}"])</script>'
+    filler = '<div class="flex items-center gap-2"><span>{\\"k\\":1}</span></div>'
+    filler_block = filler * (padding_kb * 1024 // len(filler) // (copies + 1) + 1)
+    parts = ["<html><head></head><body>", filler_block]
+    for _ in range(copies):
+        parts += [script, filler_block]
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def legacy_extract(html_content: str) -> list[dict]:
+    """重构前 ModelsManager._extract_models_from_html 的逻辑"""
+    models = []
+    model_names = set()
+    for start_match in re.finditer(r'\{\\"id\\":\\"[a-f0-9-]+\\"', html_content):
+        start_index = start_match.start()
+        open_braces = 0
+        end_index = -1
+        search_limit = start_index + 10000
+        for i in range(start_index, min(len(html_content), search_limit)):
+            if html_content[i] == "{":
+                open_braces += 1
+            elif html_content[i] == "}":
+                open_braces -= 1
+                if open_braces == 0:
+                    end_index = i + 1
+                    break
+        if end_index != -1:
+            json_string = (
+                html_content[start_index:end_index]
+                .replace('\\"', '"')
+                .replace("\\\\", "\\")
+            )
+            try:
+                model_data = json.loads(json_string)
+            except json.JSONDecodeError:
+                continue
+            model_name = model_data.get("publicName")
+            if model_name and model_name not in model_names:
+                models.append(model_data)
+                model_names.add(model_name)
+    return models
+
+
+def bench(func, html: str, repeat: int) -> tuple[float, list[dict]]:
+    best = float("inf")
+    result: list[dict] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(html)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--html", help="保存的 lmarena.ai 页面")
+    parser.add_argument("--padding-kb", type=int, default=2000)
+    parser.add_argument(
+        "--copies", type=int, default=3, help="模型列表在页面中出现的次数"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.html:
+        html = Path(args.html).read_text(encoding="utf-8")
+    else:
+        html = synthetic_page(args.padding_kb, args.copies)
+    print(f"页面大小 {len(html) / 1024:.0f}KB")
+
+    legacy_time, legacy_models = bench(legacy_extract, html, args.repeat)
+    new_time, new_models = bench(extract_models, html, args.repeat)
+    same = [m["publicName"] for m in legacy_models] == [
+        m["publicName"] for m in new_models
+    ]
+    print(f"{'方案':<10} {'耗时(ms)':>10} {'模型数':>8}")
+    print(f"{'旧版':<10} {legacy_time * 1000:>10.1f} {len(legacy_models):>8}")
+    print(f"{'单遍':<10} {new_time * 1000:>10.1f} {len(new_models):>8}")
+    print(f"加速 {legacy_time / new_time:.1f}x，结果一致: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+LMArena 流解析微基准：增量解析器 vs 旧版正则缓冲区方案
+
+用法（在插件根目录下）:
+    python -m benchmarks.bench_parser [--kb 200 400 800] [--chunk 64]
+"""
+
+import argparse
+import json
+import re
+import time
+
+from bridge.parser import LMArenaStreamParser
+
+
+def make_stream(size_kb: int, chunk_size: int, frame_chars: int) -> list[str]:
+    """
+    生成约 size_kb 大小的合成流，并按 chunk_size 切分成浏览器分片。
+    frame_chars 为每个文本帧的大致长度：小帧模拟逐 token 输出，大帧模拟长段落，
+    每隔若干帧插入一个旧实现不会消费的元数据帧（如 a8 注解）。
+    """
+    unit = '你好，世界 \\ "quoted" token '
+    text_body = (unit * (frame_chars // len(unit) + 1))[:frame_chars]
+    lines = ['af:{"messageId":"00000000-0000-0000-0000-000000000000"}\n']
+    total = 0
+    i = 0
+    while total < size_kb * 1024:
+        line = "a0:" + json.dumps(f"{i} {text_body}") + "\n"
+        if i % 20 == 0:
+            line += 'a8:[{"type":"annotation","index":%d}]\n' % i
+        lines.append(line)
+        total += len(line)
+        i += 1
+    lines.append('a2:[{"type":"image","image":"https://example.com/x.png"}]\n')
+    lines.append('ad:{"finishReason":"stop"}\n')
+    text = "".join(lines)
+    return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+# ---------------- 旧实现（与重构前 ResponseManager 的逻辑一致） ----------------
+_pat_text = re.compile(r'[ab]0:"((?:\\.|[^"\\])*)"')
+_pat_image = re.compile(r"[ab]2:(\[.*?\])")
+_pat_finish = re.compile(r'[ab]d:(\{.*?"finishReason".*?\})')
+_pat_error = re.compile(r'(\{\s*"error".*?\})', re.DOTALL)
+_cf_patterns = [
+    r"<title>Just a moment...</title>",
+    r"Enable JavaScript and cookies to continue",
+]
+
+
+def legacy_parse(chunks: list[str]) -> int:
+    buffer = ""
+    count = 0
+    for chunk in chunks:
+        buffer += chunk
+        if any(re.search(p, buffer, re.IGNORECASE) for p in _cf_patterns):
+            return count
+        if error_match := _pat_error.search(buffer):
+            try:
+                json.loads(error_match.group(1))
+                return count
+            except json.JSONDecodeError:
+                pass
+        while match_text := _pat_text.search(buffer):
+            try:
+                if json.loads(f'"{match_text.group(1)}"'):
+                    count += 1
+            except (ValueError, json.JSONDecodeError):
+                pass
+            buffer = buffer[match_text.end() :]
+        while match_img := _pat_image.search(buffer):
+            json.loads(match_img.group(1))
+            count += 1
+            buffer = buffer[match_img.end() :]
+        if match_fin := _pat_finish.search(buffer):
+            json.loads(match_fin.group(1))
+            count += 1
+            buffer = buffer[match_fin.end() :]
+    return count
+
+
+def incremental_parse(chunks: list[str]) -> int:
+    parser = LMArenaStreamParser()
+    count = 0
+    for chunk in chunks:
+        count += len(parser.feed(chunk))
+    count += len(parser.flush())
+    return count
+
+
+def bench(func, chunks: list[str], repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    result = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--kb", type=int, nargs="+", default=[100, 200, 400, 800])
+    parser.add_argument("--chunk", type=int, default=64, help="每个分片的字符数")
+    parser.add_argument(
+        "--frame", type=int, nargs="+", default=[40, 4096], help="文本帧长度"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'帧长':>6} {'大小':>8} {'分片数':>8} "
+        f"{'正则(ms)':>10} {'增量(ms)':>10} {'加速比':>8}"
+    )
+    for frame_chars in args.frame:
+        for size_kb in args.kb:
+            chunks = make_stream(size_kb, args.chunk, frame_chars)
+            t_old, n_old = bench(legacy_parse, chunks, args.repeat)
+            t_new, n_new = bench(incremental_parse, chunks, args.repeat)
+            assert n_old == n_new, f"事件数不一致: {n_old} != {n_new}"
+            print(
+                f"{frame_chars:>6} {size_kb:>6}KB {len(chunks):>8} "
+                f"{t_old * 1000:>10.1f} {t_new * 1000:>10.1f} "
+                f"{t_old / t_new:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
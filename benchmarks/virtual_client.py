@@ -0,0 +1,231 @@
+"""
+虚拟油猴脚本：用 Python 模拟 LMArenaApiBridge.js 的 WebSocket 协议，
+回放录制的或合成的 LMArena 数据流，用于离线压测桥梁服务器。
+
+单独运行（连接到已启动的桥梁）:
+    python -m benchmarks.virtual_client --url ws://127.0.0.1:5102/ws --tabs 2
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from pathlib import Path
+
+import aiohttp
+
+from bridge.protocol import PROTOCOL_VERSION, encode_frame
+
+
+def synthetic_stream(
+    text_tokens: int = 50, image_url: str | None = None, reason: str = "stop"
+) -> str:
+    """生成一段 LMArena 格式的合成数据流"""
+    lines = [f'af:{{"messageId":"{uuid.uuid4()}"}}']
+    for i in range(text_tokens):
+        lines.append("a0:" + json.dumps(f"token{i} "))
+    if image_url:
+        lines.append("a2:" + json.dumps([{"type": "image", "image": image_url}]))
+    lines.append("ad:" + json.dumps({"finishReason": reason}))
+    return "\n".join(lines) + "\n"
+
+
+class VirtualUserscript:
+    """
+    模拟一个打开了 lmarena.ai 并运行油猴脚本的浏览器标签页
+    """
+
+    def __init__(
+        self,
+        url: str = "ws://127.0.0.1:5102/ws",
+        *,
+        stream: str | None = None,
+        chunk_size: int = 64,
+        ttfb: float = 0.05,
+        chunk_delay: float = 0.0,
+        failure_rate: float = 0.0,
+        cloudflare_rate: float = 0.0,
+        reload_delay: float = 0.5,
+        seed: int | None = None,
+        compact: bool = True,
+        max_concurrency: int | None = None,
+    ):
+        """
+        url: 桥梁的 WebSocket 端点
+        stream: 要回放的原始数据流，None 时使用合成数据流
+        chunk_size: 每个 WebSocket 分片的字符数（模拟 reader.read() 的粒度）
+        ttfb: 收到请求到发出第一个分片的延迟（秒）
+        chunk_delay: 分片之间的延迟（秒）
+        failure_rate: 以 {error} 失败的请求比例
+        cloudflare_rate: 返回 Cloudflare 验证页的请求比例
+        reload_delay: 收到 refresh 指令后“刷新页面”到重新连接的耗时（秒）
+        compact: 桥梁握手后是否改用紧凑帧（False 时模拟旧版脚本的 JSON 消息）
+        max_concurrency: 握手时声明的并发上限，None 时不声明
+        """
+        self.url = url
+        self.stream = stream or synthetic_stream()
+        self.chunk_size = chunk_size
+        self.ttfb = ttfb
+        self.chunk_delay = chunk_delay
+        self.failure_rate = failure_rate
+        self.cloudflare_rate = cloudflare_rate
+        self.reload_delay = reload_delay
+        self.random = random.Random(seed)
+        self.compact = compact
+        self.max_concurrency = max_concurrency
+        self.protocol = 1
+
+        self.ws: aiohttp.ClientWebSocketResponse | None = None
+        self.session: aiohttp.ClientSession | None = None
+        self.commands: list[str] = []
+        self.handled = 0
+        self.reloads = 0
+        self._tasks: set[asyncio.Task] = set()
+        # request_id -> 处理该请求的任务，用于响应 cancel 指令
+        self._requests: dict[str, asyncio.Task] = {}
+        self.cancelled = 0
+        self._runner: asyncio.Task | None = None
+
+    @classmethod
+    def from_recording(cls, path: str | Path, **kwargs) -> "VirtualUserscript":
+        """从录制的原始数据流文件创建"""
+        return cls(stream=Path(path).read_text(encoding="utf-8"), **kwargs)
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        self.ws = await self.session.ws_connect(self.url, max_msg_size=0)
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._runner:
+            self._runner.cancel()
+        if self.ws:
+            await self.ws.close()
+        if self.session:
+            await self.session.close()
+
+    async def send(self, request_id: str, data):
+        if self.ws and not self.ws.closed:
+            if self.protocol >= 2:
+                await self.ws.send_str(encode_frame(request_id, data))
+            else:
+                await self.ws.send_str(
+                    json.dumps({"request_id": request_id, "data": data})
+                )
+
+    async def _run(self):
+        """接收循环；收到 refresh 时模拟页面刷新：断开、丢弃在途请求、重新连接"""
+        assert self.session
+        while True:
+            if await self._receive_loop() != "reload":
+                return
+            for task in list(self._tasks):
+                task.cancel()
+            if self.ws:
+                await self.ws.close()
+            await asyncio.sleep(self.reload_delay)
+            self.ws = await self.session.ws_connect(self.url, max_msg_size=0)
+            self.protocol = 1
+            self.reloads += 1
+
+    async def _receive_loop(self) -> str | None:
+        assert self.ws
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            message = json.loads(msg.data)
+            if command := message.get("command"):
+                self.commands.append(command)
+                if command == "hello" and self.compact:
+                    self.protocol = min(message.get("protocol", 1), PROTOCOL_VERSION)
+                    await self.ws.send_str(
+                        json.dumps(
+                            {
+                                "type": "hello",
+                                "protocol": PROTOCOL_VERSION,
+                                "version": "virtual",
+                                "max_concurrency": self.max_concurrency,
+                            }
+                        )
+                    )
+                    continue
+                if command in ("refresh", "reconnect"):
+                    return "reload"
+                if command == "cancel" and (
+                    task := self._requests.get(request_id := message.get("request_id"))
+                ):
+                    # 与脚本一致：中止上游请求后仍发回错误和 [DONE]
+                    task.cancel()
+                    self.cancelled += 1
+                    await self.send(request_id, {"error": "The operation was aborted."})
+                    await self.send(request_id, "[DONE]")
+                continue
+            request_id, payload = message.get("request_id"), message.get("payload")
+            if request_id and payload:
+                task = asyncio.create_task(self._handle_request(request_id, payload))
+                self._tasks.add(task)
+                self._requests[request_id] = task
+                task.add_done_callback(self._tasks.discard)
+                task.add_done_callback(
+                    lambda _, rid=request_id: self._requests.pop(rid, None)
+                )
+
+    async def _handle_request(self, request_id: str, payload: dict):
+        await asyncio.sleep(self.ttfb)
+        roll = self.random.random()
+        if not payload.get("session_id") or not payload.get("message_id"):
+            await self.send(request_id, {"error": "会话信息为空"})
+        elif roll < self.failure_rate:
+            await self.send(request_id, {"error": "网络响应不正常。状态: 500."})
+        elif roll < self.failure_rate + self.cloudflare_rate:
+            await self.send(
+                request_id,
+                {"error": "状态: 403. 内容: <title>Just a moment...</title>"},
+            )
+        else:
+            for i in range(0, len(self.stream), self.chunk_size):
+                await self.send(request_id, self.stream[i : i + self.chunk_size])
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+        await self.send(request_id, "[DONE]")
+        self.handled += 1
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="ws://127.0.0.1:5102/ws")
+    parser.add_argument("--tabs", type=int, default=1)
+    parser.add_argument("--recording", help="录制的原始数据流文件")
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--ttfb", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stream = Path(args.recording).read_text("utf-8") if args.recording else None
+    tabs = [
+        VirtualUserscript(
+            args.url,
+            stream=stream,
+            chunk_size=args.chunk_size,
+            ttfb=args.ttfb,
+            failure_rate=args.failure_rate,
+        )
+        for _ in range(args.tabs)
+    ]
+    await asyncio.gather(*(tab.start() for tab in tabs))
+    print(f"{len(tabs)} 个虚拟标签页已连接到 {args.url}，Ctrl+C 退出")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await asyncio.gather(*(tab.stop() for tab in tabs))
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
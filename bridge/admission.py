@@ -0,0 +1,109 @@
+import asyncio
+import math
+from collections import deque
+from collections.abc import Callable
+from astrbot.api import logger
+from astrbot.core.config.astrbot_config import AstrBotConfig
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    准入控制：限制在途请求总数，超出时进入有界等待队列，队列满或等待超时则快速拒绝
+    """
+
+    def __init__(self, config: AstrBotConfig, capacity: Callable[[], int | None]):
+        """
+        capacity: 返回当前允许的最大在途请求数，None 表示不限制
+        """
+        self.conf = config
+        self.capacity = capacity
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        # 平均服务时长（指数滑动平均），用于估算 Retry-After
+        self._avg_service = float(config.get("timeout", 30)) / 3
+        self.rejected = 0
+
+    def _has_room(self) -> bool:
+        limit = self.capacity()
+        return limit is None or self.in_flight < limit
+
+    def retry_after(self) -> int:
+        """估算排到队首需要等待的秒数"""
+        limit = self.capacity() or 1
+        queued = len(self._waiters) + 1
+        return max(1, math.ceil(self._avg_service * queued / max(limit, 1)))
+
+    async def acquire(self):
+        """获取一个在途名额，失败抛出 AdmissionRejected"""
+        if not self._waiters and self._has_room():
+            self.in_flight += 1
+            return
+
+        queue_size = self.conf.get("queue_size", 0)
+        if len(self._waiters) >= queue_size:
+            self.rejected += 1
+            logger.warning(f"等待队列已满({queue_size})，拒绝请求")
+            raise AdmissionRejected("请求过多，等待队列已满", self.retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(fut), self.conf.get("queue_timeout", 10)
+            )
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # 超时的同时恰好分到名额，直接使用
+                return
+            fut.cancel()
+            self.rejected += 1
+            raise AdmissionRejected("请求过多，排队超时", self.retry_after())
+        except asyncio.CancelledError:
+            # 调用方被取消（如客户端断开），归还已分到的名额
+            if fut.done() and not fut.cancelled():
+                self.release()
+            fut.cancel()
+            raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+
+    def try_acquire(self) -> bool:
+        """有空闲名额且无人排队时立即占用，否则返回 False（不排队）"""
+        if not self._waiters and self._has_room():
+            self.in_flight += 1
+            return True
+        return False
+
+    def release(self, service_time: float | None = None):
+        """归还名额并唤醒排队的请求"""
+        if service_time is not None:
+            self._avg_service = 0.8 * self._avg_service + 0.2 * service_time
+        self.in_flight = max(0, self.in_flight - 1)
+        self.wake()
+
+    def wake(self):
+        """容量变化（如新标签页连接）或名额释放时调用"""
+        while self._waiters and self._has_room():
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "capacity": self.capacity(),
+            "queued": len(self._waiters),
+            "rejected": self.rejected,
+            "avg_service_seconds": round(self._avg_service, 2),
+        }
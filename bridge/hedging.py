@@ -0,0 +1,94 @@
+import math
+import time
+from collections import deque
+from astrbot.core.config.astrbot_config import AstrBotConfig
+
+
+class LatencyTracker:
+    """
+    记录最近若干个请求的首字节耗时，用于估算对冲的触发时机
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        """最近样本的第 p 百分位（最近秩法），没有样本时返回 None"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(p / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+
+class HedgeBudget:
+    """
+    对冲预算（令牌桶）：每个普通请求存入 ratio 个令牌，每次对冲花掉一个，
+    长期来看对冲请求不超过普通请求的 ratio 倍；桶容量限制突发
+    """
+
+    def __init__(self, ratio: float, burst: float = 5):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def refund(self):
+        self.tokens += 1
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Hedger:
+    """
+    对冲请求：首个请求在最近首字节耗时的第 N 百分位内还没有数据时，
+    向另一个会话/标签页再发一份，先成功者胜出
+    """
+
+    def __init__(self, config: AstrBotConfig):
+        self.conf = config.get("hedging", {})
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget(self.conf.get("budget_percent", 10) / 100)
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_budget = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.conf.get("enabled", False))
+
+    def delay(self) -> float | None:
+        """首个请求等待首字节多久后发出对冲；样本不足时返回 None（不对冲）"""
+        if len(self.latency) < self.conf.get("min_samples", 20):
+            return None
+        value = self.latency.percentile(self.conf.get("percentile", 90))
+        if value is None:
+            return None
+        return max(value, self.conf.get("min_delay", 2))
+
+    def record_first_byte(self, sent_at: float):
+        self.latency.add(time.monotonic() - sent_at)
+
+    def stats(self) -> dict:
+        delay = self.delay()
+        return {
+            "enabled": self.enabled,
+            "samples": len(self.latency),
+            "delay_seconds": round(delay, 2) if delay is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "skipped_budget": self.skipped_budget,
+            "budget_tokens": round(self.budget.tokens, 2),
+        }
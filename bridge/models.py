@@ -1,4 +1,7 @@
 
+import asyncio
+import bisect
+import hashlib
 import os
 import re
 import json
@@ -18,6 +21,11 @@ class ModelsManager:
         )
         # {modelname: {"id": ..., "type": ...}}
         self.model_map: dict[str, dict[str, str]] = {}
+        # 小写模型名 -> publicName，及排好序的小写模型名（用于前缀查找）
+        self._lower_names: dict[str, str] = {}
+        self._sorted_names: list[str] = []
+        # 当前模型集合的摘要
+        self.digest = ""
         # 初始化时加载一次
         self.load_model_map()
 
@@ -40,88 +48,188 @@ class ModelsManager:
             for m in models:
                 if not isinstance(m, dict) or "publicName" not in m or "id" not in m:
                     continue
-                out_caps = m.get("capabilities", {}).get("outputCapabilities", {})
-                model_type = next(
-                    (
-                        t
-                        for t in ("video", "image", "search", "text")
-                        if out_caps.get(t)
-                    ),
-                    "unknown",
-                )
-
                 self.model_map[m["publicName"]] = {
                     "id": m["id"],
-                    "type": model_type,
+                    "type": model_type(m),
                 }
+        self._lower_names = {name.lower(): name for name in self.model_map}
+        self._sorted_names = sorted(self._lower_names)
+        self.digest = models_digest(models or [])
         return self.model_map
 
-    def update_from_html(self, html_content: str) -> bool:
+    def resolve(self, name: str | None) -> tuple[str, dict[str, str]] | None:
+        """
+        按 精确匹配 -> 忽略大小写 -> 前缀匹配 的顺序把请求里的模型名解析为
+        (publicName, {"id": ..., "type": ...})；前缀匹配到多个时取名字最短的，找不到返回 None
+        """
+        if not name:
+            return None
+        if info := self.model_map.get(name):
+            return name, info
+        lower = name.strip().lower()
+        if not lower:
+            return None
+        public_name = self._lower_names.get(lower)
+        if public_name is None:
+            idx = bisect.bisect_left(self._sorted_names, lower)
+            candidates = []
+            for key in self._sorted_names[idx:]:
+                if not key.startswith(lower):
+                    break
+                candidates.append(key)
+            if not candidates:
+                return None
+            public_name = self._lower_names[min(candidates, key=len)]
+        return public_name, self.model_map[public_name]
+
+    async def update_from_html(self, html_content: bytes | str) -> bool:
         """
         从 HTML 内容提取模型并更新 available_models.json
+        提取在线程池中进行，不阻塞桥梁的事件循环
         """
-        new_models_list = self._extract_models_from_html(html_content)
+        new_models_list = await asyncio.to_thread(extract_models, html_content)
         if not new_models_list:
             logger.error("未能从 HTML 提取模型数据")
             return False
+        return await self.update_models(new_models_list)
+
+    async def update_models(self, models: list[dict]) -> bool:
+        """
+        用油猴脚本提取好的模型列表更新 available_models.json，
+        模型集合没变时不写文件
+        """
+        models = [
+            m for m in models if isinstance(m, dict) and "id" in m and "publicName" in m
+        ]
+        if not models:
+            logger.error("收到的模型列表为空")
+            return False
+        digest = models_digest(models)
+        if digest == self.digest:
+            logger.info(f"模型列表未变化，共 {len(models)} 个模型")
+            return True
 
         try:
-            with open(self.available_model_path, "w", encoding="utf-8") as f:
-                json.dump(new_models_list, f, indent=4, ensure_ascii=False)
-            logger.info(f"模型列表文件已更新，共 {len(new_models_list)} 个模型")
-            self.load_model_map(new_models_list)
+            await asyncio.to_thread(self._write_models, models)
+            logger.info(f"模型列表文件已更新，共 {len(models)} 个模型")
+            self.load_model_map(models)
             return True
-        except IOError as e:
+        except OSError as e:
             logger.error(f"写入 {self.available_model_path} 出错: {e}")
             return False
 
-    def _extract_models_from_html(self, html_content):
-        """
-        从 HTML 内容中提取完整的模型JSON对象，使用括号匹配确保完整性。
-        """
-        models = []
-        model_names = set()
-
-        # 查找所有可能的模型JSON对象的起始位置
-        for start_match in re.finditer(r'\{\\"id\\":\\"[a-f0-9-]+\\"', html_content):
-            start_index = start_match.start()
-
-            # 从起始位置开始，进行花括号匹配
-            open_braces = 0
-            end_index = -1
-
-            # 优化：设置一个合理的搜索上限，避免无限循环
-            search_limit = start_index + 10000  # 假设一个模型定义不会超过10000个字符
-
-            for i in range(start_index, min(len(html_content), search_limit)):
-                if html_content[i] == "{":
-                    open_braces += 1
-                elif html_content[i] == "}":
-                    open_braces -= 1
-                    if open_braces == 0:
-                        end_index = i + 1
-                        break
-
-            if end_index != -1:
-                # 提取完整的、转义的JSON字符串
-                json_string_escaped = html_content[start_index:end_index]
-
-                # 反转义
-                json_string = json_string_escaped.replace('\\"', '"').replace(
-                    "\\\\", "\\"
-                )
-
-                try:
-                    model_data = json.loads(json_string)
-                    model_name = model_data.get("publicName")
-
-                    # 使用publicName去重
-                    if model_name and model_name not in model_names:
-                        models.append(model_data)
-                        model_names.add(model_name)
-                except json.JSONDecodeError as e:
-                    logger.warning(
-                        f"解析提取的JSON对象时出错: {e} - 内容: {json_string[:150]}..."
-                    )
-                    continue
-        return models
+    def _write_models(self, models: list[dict]):
+        """先写临时文件再替换，避免读到写了一半的文件"""
+        tmp_path = self.available_model_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(models, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.available_model_path)
+
+
+# 模型对象的起始位置：页面中转义过的 {"id":"<uuid>"
+_MODEL_START = re.compile(r'\{\\"id\\":\\"[a-f0-9-]+\\"')
+_BRACES = re.compile(r"[{}]")
+_MODEL_ID = re.compile(r"[a-f0-9-]+")
+# 单个模型对象的最大长度
+_MAX_OBJECT_LEN = 10000
+
+
+def model_type(model: dict) -> str:
+    """按输出能力判断模型类型"""
+    out_caps = model.get("capabilities", {}).get("outputCapabilities", {})
+    return next(
+        (t for t in ("video", "image", "search", "text") if out_caps.get(t)),
+        "unknown",
+    )
+
+
+def models_digest(models: list[dict]) -> str:
+    """
+    模型集合的摘要：对排好序的 "id:publicName:type" 行做 sha256，
+    与顺序和无关字段无关
+    """
+    lines = sorted(
+        f"{m['id']}:{m['publicName']}:{model_type(m)}"
+        for m in models
+        if isinstance(m, dict) and "id" in m and "publicName" in m
+    )
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def _match_brace(text: str, start: int) -> int:
+    """返回与 start 处 { 配对的 } 之后的位置，找不到时返回 -1"""
+    depth = 0
+    for m in _BRACES.finditer(text, start, min(len(text), start + _MAX_OBJECT_LEN)):
+        depth += 1 if m.group() == "{" else -1
+        if depth == 0:
+            return m.end()
+    return -1
+
+
+def _iter_models(obj):
+    """先序遍历解析结果，产出所有以 id 开头的模型对象（含嵌套的）"""
+    if isinstance(obj, dict):
+        model_id = obj.get("id")
+        if (
+            next(iter(obj), None) == "id"
+            and isinstance(model_id, str)
+            and _MODEL_ID.fullmatch(model_id)
+        ):
+            yield obj
+        for value in obj.values():
+            yield from _iter_models(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from _iter_models(value)
+
+
+def extract_models(html_content: bytes | str) -> list[dict]:
+    """
+    从 HTML 内容中提取完整的模型 JSON 对象（按 publicName 去重）。
+    单遍扫描：已解析对象内部的起始位置直接跳过，其中嵌套的模型从解析结果里取，
+    每个字符最多被括号匹配扫描一次。
+    """
+    if isinstance(html_content, bytes):
+        html_content = html_content.decode("utf-8", errors="replace")
+    models = []
+    model_names = set()
+    # 页面里同一份模型列表通常出现多次，相同的对象只解析一次
+    seen: set[str] = set()
+    consumed = 0
+
+    for start_match in _MODEL_START.finditer(html_content):
+        start_index = start_match.start()
+        if start_index < consumed:
+            continue
+        end_index = _match_brace(html_content, start_index)
+        if end_index == -1:
+            continue
+        raw = html_content[start_index:end_index]
+        if raw in seen:
+            consumed = end_index
+            continue
+        seen.add(raw)
+
+        # 反转义
+        json_string = raw.replace('\\"', '"').replace("\\\\", "\\")
+        try:
+            model_data = json.loads(json_string)
+        except json.JSONDecodeError as e:
+            logger.warning(
+                f"解析提取的JSON对象时出错: {e} - 内容: {json_string[:150]}..."
+            )
+            continue
+        consumed = end_index
+
+        # 只有内部还有模型起始标记时才需要遍历嵌套对象
+        if _MODEL_START.search(html_content, start_index + 1, end_index):
+            found = _iter_models(model_data)
+        else:
+            found = (model_data,)
+        for model in found:
+            model_name = model.get("publicName")
+            # 使用publicName去重
+            if model_name and model_name not in model_names:
+                models.append(model)
+                model_names.add(model_name)
+    return models
@@ -0,0 +1,132 @@
+import json
+from typing import Any
+
+
+class StreamTooLarge(Exception):
+    """响应超过大小上限"""
+
+
+class LMArenaStreamParser:
+    """
+    LMArena 流协议的增量解析器。
+
+    LMArena 返回按行分帧的数据流，每行形如 `a0:"文本"`、`a2:[...]`、`ad:{...}`，
+    前缀首字母是参与者位置(a/b)，第二个字符是帧类型。解析器只扫描新到达的数据，
+    未完成的行先以分片形式暂存，遇到换行再拼接，整体开销与数据量成线性关系。
+    """
+
+    # Cloudflare 识别片段（小写）
+    cf_markers = (
+        "<title>just a moment...</title>",
+        "enable javascript and cookies to continue",
+    )
+
+    # 非协议行最多保留的字符数，用于流结束时识别跨行的错误 JSON
+    unframed_limit = 64 * 1024
+
+    def __init__(self, max_bytes: int = 0):
+        # 0 表示不限制
+        self.max_bytes = max_bytes
+        self.received = 0
+        self._parts: list[str] = []
+        self._unframed: list[str] = []
+        self._unframed_size = 0
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        """
+        喂入新数据，返回解析出的事件列表:
+          ('content', str) / ('image', str) / ('finish', str) /
+          ('error', str) / ('cloudflare', str)
+        """
+        self.received += len(chunk.encode("utf-8"))
+        if self.max_bytes and self.received > self.max_bytes:
+            raise StreamTooLarge(f"响应超过大小上限 ({self.max_bytes} 字节)")
+
+        events: list[tuple[str, Any]] = []
+        start = 0
+        while (end := chunk.find("\n", start)) != -1:
+            if self._parts:
+                self._parts.append(chunk[start:end])
+                line = "".join(self._parts)
+                self._parts.clear()
+            else:
+                line = chunk[start:end]
+            self._parse_line(line, events)
+            start = end + 1
+        if start < len(chunk):
+            self._parts.append(chunk[start:])
+        return events
+
+    def flush(self) -> list[tuple[str, Any]]:
+        """流结束时处理末尾没有换行的残余数据"""
+        events: list[tuple[str, Any]] = []
+        if self._parts:
+            line = "".join(self._parts)
+            self._parts.clear()
+            self._parse_line(line, events)
+        # 跨多行的错误 JSON（如格式化输出的错误体）
+        if self._unframed and not events:
+            text = "\n".join(self._unframed)
+            self._unframed.clear()
+            if '"error"' in text:
+                try:
+                    error_json = json.loads(text)
+                    if isinstance(error_json, dict) and "error" in error_json:
+                        events.append(("error", error_json["error"]))
+                except json.JSONDecodeError:
+                    pass
+        return events
+
+    def _parse_line(self, line: str, events: list):
+        line = line.strip()
+        if not line:
+            return
+
+        # 协议帧: [ab][0-9a-z]:<json>
+        if len(line) > 2 and line[2] == ":" and line[0] in "ab":
+            kind, body = line[1], line[3:]
+            try:
+                value = json.loads(body)
+            except json.JSONDecodeError:
+                return
+            match kind:
+                case "0":
+                    if isinstance(value, str) and value:
+                        events.append(("content", value))
+                case "2":
+                    if isinstance(value, list) and value:
+                        info = value[0]
+                        if (
+                            isinstance(info, dict)
+                            and info.get("type") == "image"
+                            and "image" in info
+                        ):
+                            events.append(("image", info["image"]))
+                case "3":
+                    events.append(("error", str(value)))
+                case "d":
+                    if isinstance(value, dict) and "finishReason" in value:
+                        events.append(("finish", value.get("finishReason") or "stop"))
+            return
+
+        # 错误 JSON
+        if line.startswith("{") and '"error"' in line:
+            try:
+                error_json = json.loads(line)
+                if isinstance(error_json, dict):
+                    events.append(
+                        ("error", error_json.get("error", "来自 LMArena 的未知错误"))
+                    )
+                    return
+            except json.JSONDecodeError:
+                pass
+
+        # Cloudflare 页面
+        lower = line.lower()
+        if any(marker in lower for marker in self.cf_markers):
+            events.append(("cloudflare", line))
+            return
+
+        if self._unframed_size < self.unframed_limit:
+            self._unframed.append(line)
+            self._unframed_size += len(line)
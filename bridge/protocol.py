@@ -0,0 +1,52 @@
+"""
+桥梁与油猴脚本之间的 WebSocket 协议
+
+协议 1（旧版脚本）：每条消息都是 JSON {"request_id": ..., "data": ...}
+协议 2：连接建立后桥梁发送 {"command": "hello", "protocol": 2}，
+脚本回复 {"type": "hello", "protocol": 2, "version": ...} 后，数据流改用紧凑帧：
+
+    <类型 1 字符><request_id 36 字符><内容>
+
+    d  原始数据块（脚本可把同一轮事件循环内的多个数据块合并为一帧）
+    e  错误信息
+    f  流结束，相当于 "[DONE]"
+
+控制消息（耗时报告等）仍使用 JSON，以 "{" 开头，与紧凑帧不会混淆。
+"""
+
+PROTOCOL_VERSION = 2
+
+# request_id 为标准 UUID 字符串
+REQUEST_ID_LEN = 36
+
+FRAME_DATA = "d"
+FRAME_ERROR = "e"
+FRAME_DONE = "f"
+
+
+def encode_frame(request_id: str, data) -> str:
+    """把协议 1 的 data 编码为紧凑帧"""
+    if data == "[DONE]":
+        return f"{FRAME_DONE}{request_id}"
+    if isinstance(data, dict) and "error" in data:
+        return f"{FRAME_ERROR}{request_id}{data['error']}"
+    return f"{FRAME_DATA}{request_id}{data}"
+
+
+def decode_frame(message: str) -> tuple[str, object] | None:
+    """
+    解码紧凑帧，返回 (request_id, 协议 1 格式的 data)；
+    类型未知或长度不足时返回 None
+    """
+    if len(message) < REQUEST_ID_LEN + 1:
+        return None
+    kind = message[0]
+    request_id = message[1 : REQUEST_ID_LEN + 1]
+    body = message[REQUEST_ID_LEN + 1 :]
+    if kind == FRAME_DATA:
+        return request_id, body
+    if kind == FRAME_ERROR:
+        return request_id, {"error": body}
+    if kind == FRAME_DONE:
+        return request_id, "[DONE]"
+    return None
@@ -0,0 +1,203 @@
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from astrbot.api import logger
+from astrbot.core.config.astrbot_config import AstrBotConfig
+
+from .workers import BrowserWorker
+
+CLOSED = "closed"  # 正常派发
+OPEN = "open"  # 已发出刷新，等待标签页重连，新请求暂停
+HALF_OPEN = "half_open"  # 标签页已重连，放行一个探测请求
+
+
+class RecoveryPending(Exception):
+    """人机验证恢复期间请求未能派发"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CloudflareRecovery:
+    """
+    Cloudflare 人机验证的恢复（熔断器）：
+    首个遇到验证页的请求触发一次刷新，之后的验证错误不再重复刷新；
+    恢复期间新请求暂停派发（有数量上限和等待时限），
+    标签页重连后放行一个探测请求，成功则恢复派发，再遇验证则重新刷新
+    """
+
+    def __init__(
+        self,
+        config: AstrBotConfig,
+        refresh: Callable[[BrowserWorker], Awaitable],
+    ):
+        """
+        refresh: 刷新指定的标签页
+        """
+        self.conf = config.get("cloudflare_recovery", {})
+        self.refresh = refresh
+        self.state = CLOSED
+        # 暂停中的请求，结果为 True 表示作为探测请求放行
+        self._waiters: deque[asyncio.Future] = deque()
+        self._probing = False
+        self._refresh_task: asyncio.Task | None = None
+        self._degraded_since: float | None = None
+        self.degraded_seconds = 0.0
+        self.incidents = 0
+        self.refreshes = 0
+        self.suppressed = 0
+        self.parked = 0
+        self.rejected = 0
+
+    @property
+    def degraded(self) -> bool:
+        return self.state != CLOSED
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.conf.get("reconnect_timeout", 30) / 2))
+
+    async def wait_ready(self, hedge: bool = False) -> bool:
+        """
+        派发前调用：正常时立即返回 False；恢复期间暂停，
+        恢复后返回 False，被选为探测请求时返回 True（调用方须调用 probe_finished）。
+        队列满或等待超时抛出 RecoveryPending；对冲请求不暂停
+        """
+        if self.state == CLOSED:
+            return False
+        if hedge:
+            raise RecoveryPending("正在恢复人机验证", self.retry_after())
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+
+        park_limit = self.conf.get("park_limit", 20)
+        if len(self._waiters) >= park_limit:
+            self.rejected += 1
+            logger.warning(f"人机验证恢复中，暂停的请求已满({park_limit})，拒绝请求")
+            raise RecoveryPending(
+                "正在恢复人机验证，暂停的请求已满", self.retry_after()
+            )
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.parked += 1
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(fut), self.conf.get("park_timeout", 30)
+            )
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return fut.result()
+            fut.cancel()
+            self.rejected += 1
+            raise RecoveryPending("正在恢复人机验证，等待超时", self.retry_after())
+        except asyncio.CancelledError:
+            # 调用方被取消时交出已分到的探测资格
+            if fut.done() and not fut.cancelled() and fut.result():
+                self._probing = False
+                self._next_probe()
+            fut.cancel()
+            raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+
+    def on_challenge(self, request_id: str, worker: BrowserWorker | None):
+        """
+        请求遇到 Cloudflare 验证页：每次事故只刷新一次，且只刷新返回验证页的标签页
+        worker: 负责该请求的标签页
+        """
+        if self.state == OPEN:
+            self.suppressed += 1
+            logger.debug(f"人机验证恢复中，忽略请求 {request_id[:8]} 的验证错误")
+            return
+        if self.state == CLOSED:
+            self.incidents += 1
+            self._degraded_since = time.monotonic()
+            logger.warning("检测到 Cloudflare 人机验证，暂停派发并刷新页面")
+        else:
+            logger.warning("探测请求再次遇到人机验证，重新刷新页面")
+        self.state = OPEN
+        self._probing = False
+        self.refreshes += 1
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        self._refresh_task = asyncio.create_task(self._refresh(worker))
+
+    async def _refresh(self, worker: BrowserWorker | None):
+        """发出刷新指令；迟迟没有标签页重连时也转入探测阶段，由探测结果决定是否再次刷新"""
+        if worker is None:
+            # 不知道是哪个标签页时不刷新，以免打断其他标签页上的请求
+            logger.warning("找不到返回验证页的标签页，不发送刷新指令")
+        else:
+            try:
+                await self.refresh(worker)
+            except Exception as e:
+                logger.error(f"发送刷新指令失败: {e}")
+        await asyncio.sleep(self.conf.get("reconnect_timeout", 30))
+        if self.state == OPEN:
+            logger.warning("等待标签页重连超时，尝试探测请求")
+            self._half_open()
+
+    def on_worker_connected(self):
+        """标签页（重新）连接：进入探测阶段"""
+        if self.state == OPEN:
+            logger.info("标签页已重连，放行一个探测请求")
+            self._half_open()
+
+    def _half_open(self):
+        self.state = HALF_OPEN
+        self._probing = False
+        self._next_probe()
+
+    def _next_probe(self):
+        """把探测资格交给最早暂停的请求"""
+        while self._waiters and not self._probing:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._probing = True
+                fut.set_result(True)
+
+    def probe_finished(self, ok: bool):
+        """
+        探测请求结束：成功则恢复派发；
+        遇到验证时 on_challenge 已重新打开熔断器，其他失败换下一个请求探测
+        """
+        if self.state != HALF_OPEN:
+            return
+        self._probing = False
+        if not ok:
+            self._next_probe()
+            return
+        self.state = CLOSED
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._degraded_since is not None:
+            spent = time.monotonic() - self._degraded_since
+            self.degraded_seconds += spent
+            self._degraded_since = None
+            logger.info(f"✅ 人机验证已恢复，降级持续 {spent:.1f} 秒")
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(False)
+
+    def stats(self) -> dict:
+        degraded = self.degraded_seconds
+        if self._degraded_since is not None:
+            degraded += time.monotonic() - self._degraded_since
+        return {
+            "state": self.state,
+            "incidents": self.incidents,
+            "refreshes": self.refreshes,
+            "suppressed": self.suppressed,
+            "parked": len(self._waiters),
+            "parked_total": self.parked,
+            "rejected": self.rejected,
+            "degraded_seconds": round(degraded, 1),
+        }
@@ -3,11 +3,14 @@ import json
 import re
 import time
 import uuid
-from typing import Any
-from fastapi import Response
+from typing import Any, Awaitable, Callable
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from astrbot.api import logger
 from astrbot.core.config.astrbot_config import AstrBotConfig
 
+from .parser import LMArenaStreamParser, StreamTooLarge
+
 
 class ResponseManager:
     """
@@ -19,18 +22,25 @@ class ResponseManager:
         self.channels: dict[str, asyncio.Queue] = {}
         self.callback: Any = None
 
-        # 预编译正则
-        self._pat_text = re.compile(r'[ab]0:"((?:\\.|[^"\\])*)"')
-        self._pat_image = re.compile(r"[ab]2:(\[.*?\])")
-        self._pat_finish = re.compile(r'[ab]d:(\{.*?"finishReason".*?\})')
-        self._pat_error = re.compile(r'(\{\s*"error".*?\})', re.DOTALL)
-
         # Cloudflare 识别片段
         self._cf_patterns = [
             r"<title>Just a moment...</title>",
             r"Enable JavaScript and cookies to continue",
         ]
 
+    # 错误文案 -> 错误码，调用方据此区分能否重试（按顺序匹配）
+    _error_codes = [
+        (r"附件大小超过了", "attachment_too_large"),
+        (r"Cloudflare", "cloudflare_challenge"),
+        (r"状态: 422|\b422\b", "content_rejected"),
+        (r"状态: 429", "upstream_rate_limited"),
+        (r"timed out", "upstream_timeout"),
+        (r"Browser disconnected", "browser_disconnected"),
+        (r"响应超过大小上限", "response_too_large"),
+        (r"会话信息", "session_missing"),
+        (r"状态: 404", "session_invalid"),
+    ]
+
     # ---------------- OpenAI 格式化 ----------------
     def _make_non_stream(
         self, content: str, model: str, request_id: str, reason: str = "stop"
@@ -55,6 +65,43 @@ class ResponseManager:
             },
         }
 
+    def _make_stream_chunk(
+        self,
+        model: str,
+        request_id: str,
+        content: str | None = None,
+        reason: str | None = None,
+        role: bool = False,
+    ) -> str:
+        """流式响应块（SSE 格式），按 OpenAI 的约定只在第一个块里带 role"""
+        delta: dict[str, str] = {"role": "assistant"} if role else {}
+        if content:
+            delta["content"] = content
+        chunk = {
+            "id": request_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": reason}],
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    @classmethod
+    def _make_error(cls, error_msg: str) -> tuple[int, dict]:
+        """错误响应体，返回 (状态码, 响应体)"""
+        code = next(
+            (c for p, c in cls._error_codes if re.search(p, str(error_msg))),
+            "processing_error",
+        )
+        status_code = 413 if code == "attachment_too_large" else 500
+        return status_code, {
+            "error": {
+                "message": f"[LMArena Bridge Error]: {error_msg}",
+                "type": "bridge_error",
+                "code": code,
+            }
+        }
+
     # ---------------- 错误辅助 ----------------
     def _is_cloudflare_error(self, text: str) -> bool:
         return any(re.search(p, text, re.IGNORECASE) for p in self._cf_patterns)
@@ -71,8 +118,9 @@ class ResponseManager:
                 return "上传失败：附件大小超过了 LMArena 服务器的限制 (通常约 5MB)。请压缩或更换更小的文件。"
 
             case msg if self._is_cloudflare_error(error_msg) or "cloudflare" in msg:
+                # 由恢复状态机合并同一次事故的多个验证错误，只刷新一次
                 if self.callback:
-                    asyncio.create_task(self.callback())
+                    self.callback(request_id)
                 return "检测到 Cloudflare 错误。已尝试刷新人机验证，请稍后再试。"
 
             case _:
@@ -90,8 +138,7 @@ class ResponseManager:
             yield "error", "Internal server error: response channel not found."
             return
 
-        buffer: Any = ""
-        has_yielded_content = False
+        parser = LMArenaStreamParser(self.conf.get("max_response_kb", 0) * 1024)
 
         try:
             while True:
@@ -111,81 +158,44 @@ class ResponseManager:
                         yield "error", self._handle_error(err, request_id)
                         return
                     case "[DONE]":  # 结束信号
-                        if has_yielded_content and getattr(
-                            self, "IS_REFRESHING_FOR_VERIFICATION", False
-                        ):
-                            logger.info(
-                                f"PROCESSOR [ID: {request_id[:8]}]: 请求成功完成，重置人机验证状态。"
-                            )
-                            self.IS_REFRESHING_FOR_VERIFICATION = False
-                        break
+                        events = parser.flush()
                     case list() as lst:
-                        buffer += "".join(str(item) for item in lst)
+                        events = parser.feed("".join(str(item) for item in lst))
                     case _:
-                        buffer += str(raw_data)
-
-                # Cloudflare 检测（页面片段）
-                if self._is_cloudflare_error(buffer):
-                    yield "error", self._handle_error(buffer, request_id)
-
-                # 错误 JSON
-                if error_match := self._pat_error.search(buffer):
-                    try:
-                        error_json = json.loads(error_match.group(1))
-                        yield (
-                            "error",
-                            error_json.get("error", "来自 LMArena 的未知错误"),
-                        )
-                        return
-                    except json.JSONDecodeError:
-                        pass
-
-                # 文本内容
-                while match_text := self._pat_text.search(buffer):
-                    try:
-                        text_content = json.loads(f'"{match_text.group(1)}"')
-                        if text_content:
-                            has_yielded_content = True
-                            yield "content", text_content
-                    except (ValueError, json.JSONDecodeError):
-                        pass
-                    buffer = buffer[match_text.end() :]
-
-                # 图片内容
-                while match_img := self._pat_image.search(buffer):
-                    try:
-                        image_data_list = json.loads(match_img.group(1))
-                        if isinstance(image_data_list, list) and image_data_list:
-                            image_info = image_data_list[0]
-                            if (
-                                image_info.get("type") == "image"
-                                and "image" in image_info
-                            ):
-                                yield "content", f"![Image]({image_info['image']})"
-                    except (json.JSONDecodeError, IndexError) as e:
-                        logger.warning(
-                            f"解析图片URL时出错: {e}, buffer: {buffer[:150]}"
-                        )
-                    buffer = buffer[match_img.end() :]
+                        events = parser.feed(str(raw_data))
+
+                for event_type, data in events:
+                    match event_type:
+                        case "content":
+                            yield "content", data
+                        case "image":
+                            yield "content", f"![Image]({data})"
+                        case "finish":
+                            yield "finish", data
+                        case "cloudflare":
+                            yield "error", self._handle_error(data, request_id)
+                            return
+                        case "error":
+                            yield "error", data
+                            return
 
-                # 结束原因
-                if match_fin := self._pat_finish.search(buffer):
-                    try:
-                        finish_data = json.loads(match_fin.group(1))
-                        yield "finish", finish_data.get("finishReason", "stop")
-                    except (json.JSONDecodeError, IndexError):
-                        pass
-                    buffer = buffer[match_fin.end() :]
+                if raw_data == "[DONE]":
+                    break
 
+        except StreamTooLarge as e:
+            logger.warning(f"PROCESSOR [ID: {request_id[:8]}]: {e}")
+            yield "error", str(e)
         except asyncio.CancelledError:
+            # 必须继续抛出：吞掉后调用方会把被取消的请求当作成功的空响应
             logger.debug(f"PROCESSOR [ID: {request_id[:8]}]: 任务被取消。")
+            raise
         finally:
             if request_id in self.channels:
                 del self.channels[request_id]
 
     # ---------------- 对外接口 ----------------
-    async def non_stream_response(self, request_id: str, model: str):
-        """聚合内部事件流并返回单个 OpenAI JSON 响应。"""
+    async def collect(self, request_id: str, model: str) -> tuple[int, dict]:
+        """聚合内部事件流，返回 (状态码, OpenAI 响应体)。"""
         response_id = f"chatcmpl-{uuid.uuid4()}"
         full_content: list[str] = []
         finish_reason = "stop"
@@ -205,27 +215,68 @@ class ResponseManager:
                     logger.error(
                         f"NON-STREAM [ID: {request_id[:8]}]: 处理时发生错误: {data}"
                     )
-                    status_code = 413 if "附件大小超过了" in str(data) else 500
-                    error_response = {
-                        "error": {
-                            "message": f"[LMArena Bridge Error]: {data}",
-                            "type": "bridge_error",
-                            "code": "attachment_too_large"
-                            if status_code == 413
-                            else "processing_error",
-                        }
-                    }
-                    return Response(
-                        content=json.dumps(error_response, ensure_ascii=False),
-                        status_code=status_code,
-                        media_type="application/json",
-                    )
+                    return self._make_error(data)
 
         final_content = "".join(full_content)
-        response_data = self._make_non_stream(
+        return 200, self._make_non_stream(
             final_content, model, response_id, finish_reason
         )
-        return Response(
-            content=json.dumps(response_data, ensure_ascii=False),
-            media_type="application/json",
+
+    def stream_response(
+        self,
+        request_id: str,
+        model: str,
+        on_finish: Callable[[bool, str | None], Awaitable[Any]] | None = None,
+    ) -> StreamingResponse:
+        """
+        将内部事件流转换为 OpenAI 兼容的 SSE 流式响应。
+        on_finish(ok, 错误码) 在响应结束后调用（包括客户端提前断开）。
+        """
+        response_id = f"chatcmpl-{uuid.uuid4()}"
+        state: dict[str, Any] = {"ok": False, "code": None}
+
+        async def _generate():
+            finish_reason = "stop"
+            first = True
+            async for event_type, data in self._process_lmarena_stream(request_id):
+                match event_type:
+                    case "content":
+                        yield self._make_stream_chunk(
+                            model, response_id, data, role=first
+                        )
+                        first = False
+                    case "finish":
+                        finish_reason = data
+                        if data == "content-filter":
+                            yield self._make_stream_chunk(
+                                model,
+                                response_id,
+                                "\n\n响应被终止，可能是上下文超限或者模型内部审查（大概率）的原因",
+                                role=first,
+                            )
+                            first = False
+                    case "error":
+                        logger.error(
+                            f"STREAM [ID: {request_id[:8]}]: 处理时发生错误: {data}"
+                        )
+                        _, error_response = self._make_error(data)
+                        state["code"] = error_response["error"]["code"]
+                        yield f"data: {json.dumps(error_response, ensure_ascii=False)}\n\n"
+                        yield "data: [DONE]\n\n"
+                        return
+            state["ok"] = True
+            yield self._make_stream_chunk(
+                model, response_id, reason=finish_reason, role=first
+            )
+            yield "data: [DONE]\n\n"
+
+        async def _finish():
+            if on_finish:
+                await on_finish(state["ok"], state["code"])
+
+        return StreamingResponse(
+            _generate(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(_finish),
         )
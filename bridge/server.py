@@ -1,17 +1,48 @@
 import asyncio
 import json
+import time
+import zlib
 from aiohttp import web
 import threading
 from astrbot.api import logger
 import uuid
-from fastapi import WebSocket, WebSocketDisconnect, Request, HTTPException, FastAPI
+from fastapi import (
+    WebSocket,
+    WebSocketDisconnect,
+    Request,
+    Response,
+    HTTPException,
+    FastAPI,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from astrbot.core.config.astrbot_config import AstrBotConfig
-from typing import Optional
+from typing import Callable, Coroutine, Optional
 
+from .admission import AdmissionController, AdmissionRejected
+from .hedging import Hedger
 from .models import ModelsManager
 from .response import ResponseManager
 from .process import Process
+from .protocol import PROTOCOL_VERSION, decode_frame
+from .recovery import CloudflareRecovery, RecoveryPending
+from .sessions import SESSION_ERRORS, SessionPool, SessionSlot
+from .workers import BrowserWorker, WorkerPool
+
+
+# 模型列表解压后的大小上限
+MAX_MODELS_PAYLOAD = 32 * 1024 * 1024
+
+# 标签页断开后，尚未收到数据的请求最多改派的次数（避免让标签页崩溃的请求反复重发）
+MAX_REPLAYS = 2
+
+
+def _gunzip(data: bytes, limit: int) -> bytes:
+    """解压 gzip 数据，超过 limit 时抛出 ValueError"""
+    decompressor = zlib.decompressobj(wbits=31)
+    out = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail:
+        raise ValueError("解压后的内容过大")
+    return out
 
 
 class FastAPIWrapper:
@@ -36,9 +67,11 @@ class FastAPIWrapper:
 
         self._setup_routes()
 
-    @staticmethod
-    async def lifespan(app: FastAPI):
+    async def lifespan(self, app: FastAPI):
+        # 记录桥梁所在的事件循环，供进程内调用使用
+        self.server.loop = asyncio.get_running_loop()
         yield
+        self.server.loop = None
 
     def _setup_routes(self):
         app = self.app
@@ -56,6 +89,10 @@ class FastAPIWrapper:
         async def chat_completions(request: Request):
             return await s.chat_completions(request)
 
+        @app.get("/internal/stats")
+        async def get_stats(request: Request):
+            return await s.get_stats(request)
+
         @app.post("/internal/update_available_models")
         async def update_available_models(request: Request):
             return await s.update_available_models_endpoint(request)
@@ -87,38 +124,134 @@ class FastAPIWrapper:
             logger.info("LMArena 桥梁服务器已优雅关闭")
 
 
+class InflightRequest:
+    """
+    已发给油猴脚本、尚未结束的请求
+    """
+
+    def __init__(
+        self,
+        request_id: str,
+        slot: SessionSlot,
+        worker: BrowserWorker,
+        payload: dict,
+        timeout: float,
+    ):
+        self.request_id = request_id
+        self.slot = slot
+        self.worker = worker
+        # 标签页断开时用于改派
+        self.payload = payload
+        self.sent_at = time.monotonic()
+        # 改派也必须在首次发送时的时限内完成
+        self.deadline = self.sent_at + timeout
+        self.replays = 0
+        # 人机验证恢复中被放行的探测请求，结束时须报告结果
+        self.probe = False
+        # 收到第一个数据块时置位
+        self.first_byte = asyncio.Event()
+
+
 class LMArenaBridgeServer:
     """
     LMArena Bridge 后端服务
     """
 
-    browser_ws: WebSocket | None = None  # 与单个油猴脚本的 WebSocket 连接
-
     def __init__(self, config: AstrBotConfig):
         self.conf = config
+        # 所有已连接的油猴脚本（每个标签页一个 worker）
+        self.workers = WorkerPool()
+        # 捕获到的会话ID池
+        self.sessions = SessionPool(config)
+        # 准入控制
+        self.admission = AdmissionController(config, self._capacity)
         # 消息模版处理器
         self.processor = Process(config)
         # 响应管理器
         self.responser = ResponseManager(config)
-        self.responser.callback = self.refresh
+        # Cloudflare 人机验证恢复：每次事故只刷新一次，恢复期间暂停派发
+        self.recovery = CloudflareRecovery(config, self.refresh)
+        self.responser.callback = self._on_challenge
 
         # 模型管理器
         self.model_mgr = ModelsManager(config)
 
+        # request_id -> 在途请求
+        self.inflight: dict[str, InflightRequest] = {}
+        # 对冲请求
+        self.hedger = Hedger(config)
+        # 有标签页连接时置位并换新，供等待改派的请求使用
+        self._worker_joined = asyncio.Event()
+        # 进行中的改派任务，保留引用以免被回收
+        self._replays: set[asyncio.Task] = set()
+        self.replayed = 0
+        self.replay_failed = 0
+
+        # uvicorn 线程中的事件循环，启动后由 FastAPIWrapper 设置
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def _capacity(self) -> int | None:
+        """
+        允许的最大在途请求数 = 各健康标签页上限之和，
+        单个标签页的上限取配置值和脚本握手时声明的并发数中较小的一个
+        """
+        per_browser = self.conf.get("max_inflight_per_browser", 0)
+        total = 0
+        for worker in self.workers.workers.values():
+            if not worker.healthy:
+                continue
+            limit = worker.limit(per_browser)
+            if limit is None:
+                return None
+            total += limit
+        return total if total or per_browser > 0 else None
+
     # ---------------- WS处理 ----------------
     async def websocket_endpoint(self, websocket: WebSocket):
         """处理来自油猴脚本的 WebSocket 连接。"""
         await websocket.accept()
-        self.browser_ws = websocket
-        logger.info("✅ 油猴脚本已成功连接 WebSocket。")
-        # 刷新模型列表
-        await self.trigger_model_update()
+        worker = self.workers.add(websocket)
+        logger.info(f"✅ 油猴脚本已成功连接 WebSocket（标签页 {worker.id}）。")
+        # 容量增加，放行排队中的请求
+        self.admission.wake()
+        # 人机验证恢复中的标签页刷新后会重新连接，开始探测
+        self.recovery.on_worker_connected()
+        # 唤醒等待改派的请求
+        self._worker_joined.set()
+        self._worker_joined = asyncio.Event()
         try:
+            # 宣告协议版本，新版脚本回复 hello 后改用紧凑帧，旧版脚本会忽略
+            await worker.send({"command": "hello", "protocol": PROTOCOL_VERSION})
+            # 刷新模型列表
+            await self.trigger_model_update(worker)
             while True:
                 # 等待并接收来自油猴脚本的消息
                 message_str = await websocket.receive_text()
-                logger.debug(f"[油猴->本地]: {message_str[:100]}")
+                logger.debug(f"[油猴 {worker.id}->本地]: {message_str[:100]}")
+
+                # 紧凑帧：数据块、错误和结束信号，无需 JSON 解析
+                if not message_str.startswith("{"):
+                    if frame := decode_frame(message_str):
+                        await self._dispatch(worker, *frame)
+                    else:
+                        logger.warning(f"[油猴脚本]无效帧: {message_str[:100]}")
+                    continue
+
                 message = json.loads(message_str)
+                if message.get("type") == "hello":
+                    worker.protocol = min(
+                        int(message.get("protocol", 1)), PROTOCOL_VERSION
+                    )
+                    worker.version = message.get("version")
+                    if isinstance(limit := message.get("max_concurrency"), int):
+                        worker.max_concurrency = limit if limit > 0 else None
+                        # 容量可能变化
+                        self.admission.wake()
+                    logger.info(
+                        f"标签页 {worker.id} 握手完成：脚本 v{worker.version}，协议 {worker.protocol}，"
+                        f"并发上限 {worker.max_concurrency or '未声明'}"
+                    )
+                    continue
 
                 request_id = message.get("request_id")
                 data = message.get("data")
@@ -127,41 +260,188 @@ class LMArenaBridgeServer:
                     logger.warning(f"[油猴脚本]无效消息: {message}")
                     continue
 
-                # 将收到的数据放入对应的响应通道
-                if request_id in self.responser.channels:
-                    await self.responser.channels[request_id].put(data)
-                else:
-                    logger.warning(f"[油猴脚本]未知响应: {request_id}")
+                # 请求耗时报告，不进入响应通道
+                if isinstance(data, dict) and "timing" in data:
+                    worker.record_timing(data["timing"])
+                    logger.debug(
+                        f"[油猴 {worker.id}] 请求 {request_id[:8]} 耗时: {data['timing']}"
+                    )
+                    continue
+
+                await self._dispatch(worker, request_id, data)
 
         except WebSocketDisconnect:
-            logger.warning("❌ 油猴脚本客户端已断开连接。")
+            logger.warning(f"❌ 油猴脚本客户端（标签页 {worker.id}）已断开连接。")
         except Exception as e:
             logger.error(f"WebSocket 处理时发生未知错误: {e}", exc_info=True)
         finally:
-            self.browser_ws = None
-            for queue in self.responser.channels.values():
+            # 该标签页名下尚未收到数据的请求改派，已经输出了部分内容的只能失败
+            for request_id in self.workers.remove(worker):
+                req = self.inflight.get(request_id)
+                if (
+                    req
+                    and not req.first_byte.is_set()
+                    and req.replays < MAX_REPLAYS
+                    and request_id in self.responser.channels
+                ):
+                    task = asyncio.create_task(self._replay(req))
+                    self._replays.add(task)
+                    task.add_done_callback(self._replay_done)
+                elif queue := self.responser.channels.pop(request_id, None):
+                    await queue.put({"error": "Browser disconnected during operation"})
+
+    def _replay_done(self, task: asyncio.Task):
+        self._replays.discard(task)
+        if not task.cancelled() and (e := task.exception()):
+            logger.error(f"改派请求时发生错误: {e}", exc_info=e)
+
+    async def _replay(self, req: InflightRequest):
+        """
+        把断开的标签页上尚未收到数据的请求改派给其他标签页，
+        没有可用标签页时等待重新连接；超出原有时限才让请求失败
+        """
+        request_id = req.request_id
+        while self.inflight.get(request_id) is req:
+            # 与新请求一样经过人机验证恢复：恢复期间暂停，重连后只放行一个探测请求
+            if not req.probe and self.recovery.degraded:
+                try:
+                    probe = await self.recovery.wait_ready()
+                except RecoveryPending:
+                    break
+                if self.inflight.get(request_id) is not req:
+                    # 暂停期间请求已经结束，交还探测资格
+                    if probe:
+                        self.recovery.probe_finished(False)
+                    return
+                req.probe = probe
+                continue
+            if worker := self.workers.pick():
+                self.workers.assign(request_id, worker)
+                req.worker = worker
+                req.sent_at = time.monotonic()
+                try:
+                    await worker.send(req.payload)
+                except Exception as e:
+                    self.workers.release(request_id)
+                    worker.healthy = False
+                    logger.error(f"向标签页 {worker.id} 改派请求失败: {e}")
+                    continue
+                req.replays += 1
+                self.replayed += 1
+                logger.info(
+                    f"请求 {request_id[:8]} 未收到数据时标签页断开，已改派给标签页 {worker.id}"
+                )
+                return
+            remaining = req.deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._worker_joined.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        if self.inflight.get(request_id) is req:
+            self.replay_failed += 1
+            logger.warning(f"请求 {request_id[:8]} 在时限内没有可用的标签页，放弃改派")
+            if queue := self.responser.channels.pop(request_id, None):
                 await queue.put({"error": "Browser disconnected during operation"})
-            self.responser.channels.clear()
 
-    async def ws_send(self, payload: dict):
-        if not self.browser_ws:
+    async def _dispatch(self, worker: BrowserWorker, request_id: str, data):
+        """将收到的数据放入对应的响应通道"""
+        if data == "[DONE]" and request_id in worker.in_flight:
+            worker.finished.add(request_id)
+        elif isinstance(data, str) and (req := self.inflight.get(request_id)):
+            if not req.first_byte.is_set():
+                req.first_byte.set()
+                self.hedger.record_first_byte(req.sent_at)
+
+        if request_id in self.responser.channels:
+            await self.responser.channels[request_id].put(data)
+        elif request_id in worker.cancelled:
+            # 已取消的请求，浏览器收尾时发回的数据
+            if data == "[DONE]":
+                worker.cancelled.discard(request_id)
+        else:
+            logger.warning(f"[油猴脚本]未知响应: {request_id}")
+
+    async def ws_send(self, payload: dict, worker: BrowserWorker | None = None):
+        """发送给指定 worker；未指定时发给负载最低的健康 worker"""
+        worker = worker or self.workers.pick()
+        if not worker:
             raise HTTPException(
                 status_code=503,
                 detail="油猴脚本客户端未连接。请确保 LMArena 页面已打开并激活脚本。",
             )
+        try:
+            await worker.send(payload)
+        except Exception as e:
+            worker.healthy = False
+            logger.error(f"向标签页 {worker.id} 发送消息失败: {e}")
+            raise HTTPException(status_code=503, detail="油猴脚本连接异常，请稍后再试")
 
-        await self.browser_ws.send_text(json.dumps(payload, ensure_ascii=False))
-        truncated_payload = json.dumps(payload, ensure_ascii=False)[:200]
-        logger.debug(f"[本地->油猴]: {truncated_payload}...")
+    async def broadcast(self, payload: dict) -> int:
+        """发送给所有已连接的 worker，返回成功数"""
+        if not self.workers:
+            raise HTTPException(
+                status_code=503,
+                detail="油猴脚本客户端未连接。请确保 LMArena 页面已打开并激活脚本。",
+            )
+        sent = 0
+        for worker in list(self.workers.workers.values()):
+            try:
+                await worker.send(payload)
+                sent += 1
+            except Exception as e:
+                logger.error(f"向标签页 {worker.id} 广播失败: {e}")
+        return sent
+
+    async def cancel(self, request_id: str, reason: str) -> bool:
+        """通知油猴脚本中止仍在进行的上游请求，释放浏览器和会话"""
+        worker = self.workers.running(request_id)
+        if not worker:
+            return False
+        self.workers.release(request_id)
+        worker.cancelled.add(request_id)
+        try:
+            await worker.send(
+                {"command": "cancel", "request_id": request_id, "reason": reason}
+            )
+        except Exception as e:
+            worker.cancelled.discard(request_id)
+            logger.debug(f"向标签页 {worker.id} 发送取消指令失败: {e}")
+            return False
+        logger.info(f"已通知标签页 {worker.id} 取消请求 {request_id[:8]}: {reason}")
+        return True
+
+    def _on_challenge(self, request_id: str):
+        """
+        响应中检测到验证页：请求结束时会释放标签页，
+        必须在此时记下负责它的标签页，之后只刷新这一个
+        """
+        self.recovery.on_challenge(request_id, self.workers.owner_of(request_id))
 
     # ---------------- main.py调用的接口 ----------------
-    async def refresh(self):
-        """刷新油猴脚本页面"""
-        await self.ws_send({"command": "refresh"})
+    async def refresh(self, worker: BrowserWorker | None = None):
+        """
+        刷新油猴脚本页面：指定标签页时只刷新它，否则全部刷新
+        """
+        if not worker:
+            await self.broadcast({"command": "refresh"})
+            return
+        if worker.id not in self.workers.workers:
+            # 已经断开，重连时就是新页面
+            return
+        # 刷新完成前不再往该标签页派发请求
+        worker.healthy = False
+        await self.ws_send({"command": "refresh"}, worker)
 
-    async def trigger_model_update(self):
+    async def trigger_model_update(self, worker: BrowserWorker | None = None):
         """让油猴发送页面源代码"""
-        await self.ws_send({"command": "send_page_source"})
+        # 附带当前模型摘要，新版脚本仅在模型变化时才上传
+        await self.ws_send(
+            {"command": "send_page_source", "models_digest": self.model_mgr.digest},
+            worker,
+        )
 
     def get_model_dict(self) -> dict:
         """获取所有模型列表"""
@@ -172,11 +452,26 @@ class LMArenaBridgeServer:
         host: str = "127.0.0.1",
         port: int = 5103,
         timeout: int = 20,
+        model: str | None = None,
     ) -> str:
         """
         一次性 aiohttp 监听器，等待 Tampermonkey 推送 {sessionId, messageId}
+        指定 model 时把捕获到的会话标记为该模型。
+        从插件主循环调用，整个捕获过程在桥梁的事件循环中执行
         """
-        await self.ws_send({"command": "activate_id_capture"})
+        if not self.loop or self.loop.is_closed():
+            return "桥梁尚未启动，请稍后再试"
+        return await self._run_in_loop(self._update_id(host, port, timeout, model))
+
+    async def _update_id(
+        self, host: str, port: int, timeout: int, model: str | None
+    ) -> str:
+        """update_id 的实现，必须在桥梁的事件循环中运行"""
+        if model:
+            if not (resolved := self.model_mgr.resolve(model)):
+                return f"未知模型: {model}，可用 lm模型 查看"
+            model = resolved[0]
+        await self.broadcast({"command": "activate_id_capture"})
         loop = asyncio.get_event_loop()
         future = loop.create_future()
 
@@ -218,9 +513,10 @@ class LMArenaBridgeServer:
             try:
                 sid, mid = await asyncio.wait_for(future, timeout)
                 self.conf.update({"session_id": sid, "message_id": mid})
-                self.conf.save_config()
+                self.sessions.add(sid, mid, model)
                 logger.info(f"✅ 成功捕获并保存: {sid}, {mid}")
-                return f"已捕获会话ID: {sid[:8]}..."
+                tag = f"（{model}）" if model else ""
+                return f"已捕获会话ID: {sid[:8]}...{tag}（会话池共 {len(self.sessions)} 个）"
             except asyncio.TimeoutError:
                 logger.warning("⏳ 捕获超时")
                 return "捕获超时"
@@ -231,6 +527,18 @@ class LMArenaBridgeServer:
             await runner.cleanup()
 
     # ---------------- FastAPI调用 ----------------
+    def _check_api_key(self, request: Request):
+        if self.conf["bridge_server"]["api_key"]:
+            auth_header = request.headers.get("Authorization")
+            if not auth_header or not auth_header.startswith("Bearer "):
+                raise HTTPException(
+                    status_code=401,
+                    detail="未提供 API Key。请在 Authorization 头部中以 'Bearer YOUR_KEY' 格式提供。",
+                )
+            provided_key = auth_header.split(" ")[1]
+            if provided_key != self.conf["bridge_server"]["api_key"]:
+                raise HTTPException(status_code=401, detail="提供的 API Key 不正确。")
+
     async def chat_completions(self, request: Request):
         """
         FastAPI 路由函数
@@ -243,55 +551,361 @@ class LMArenaBridgeServer:
             raise HTTPException(status_code=400, detail="无效的 JSON 请求体")
 
         # API Key 验证
-        if self.conf["bridge_server"]["api_key"]:
-            auth_header = request.headers.get("Authorization")
-            if not auth_header or not auth_header.startswith("Bearer "):
+        self._check_api_key(request)
+
+        # 返回响应（stream 参数开启流式响应）
+        if openai_req.get("stream"):
+            request_id, model, finish = await self._submit(openai_req)
+            return self.responser.stream_response(request_id, model, on_finish=finish)
+
+        # 非流式请求不会因客户端断开而中断，需要自己盯着连接
+        task = asyncio.create_task(self._complete(openai_req))
+        while not task.done():
+            await asyncio.wait({task}, timeout=1)
+            if not task.done() and await request.is_disconnected():
+                logger.info("API CALL: 客户端已断开，取消请求")
+                task.cancel()
+                await asyncio.wait({task})
+                return Response(status_code=499)
+        status_code, response_data = task.result()
+        return Response(
+            content=json.dumps(response_data, ensure_ascii=False),
+            status_code=status_code,
+            media_type="application/json",
+        )
+
+    async def complete(self, openai_req: dict) -> tuple[int, dict]:
+        """
+        进程内调用入口：跳过 HTTP 和 JSON 序列化，返回 (状态码, OpenAI 响应体)。
+        必须在桥梁所在的事件循环中运行，其他线程请使用 complete_threadsafe。
+        """
+        try:
+            return await self._complete(openai_req)
+        except HTTPException as e:
+            error = {"message": str(e.detail), "type": "bridge_error"}
+            if e.status_code == 429:
+                error["code"] = "overloaded"
+                error["retry_after"] = int((e.headers or {}).get("Retry-After", 1))
+            elif e.status_code == 503:
+                error["code"] = "unavailable"
+                if retry_after := (e.headers or {}).get("Retry-After"):
+                    error["retry_after"] = int(retry_after)
+            return e.status_code, {"error": error}
+
+    async def complete_threadsafe(self, openai_req: dict) -> tuple[int, dict]:
+        """从插件主循环调用 complete，请求在桥梁的事件循环中执行"""
+        return await self._run_in_loop(self.complete(openai_req))
+
+    async def _run_in_loop(self, coro: Coroutine):
+        """在桥梁的事件循环中运行 coro 并等待结果（标签页连接、会话池都属于该循环）"""
+        if not self.loop or self.loop.is_closed():
+            coro.close()
+            raise RuntimeError("桥梁事件循环未运行")
+        if self.loop is asyncio.get_running_loop():
+            return await coro
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return await asyncio.wrap_future(future)
+
+    def _resolve_model(self, name: str | None) -> tuple[str, dict] | None:
+        """解析请求的模型名，未知模型沿用会话当前的模型"""
+        if not name or name == "default_model":
+            return None
+        resolved = self.model_mgr.resolve(name)
+        if not resolved:
+            logger.warning(f"未知模型 {name}，将使用会话当前的模型")
+        return resolved
+
+    async def _submit(
+        self, openai_req: dict, hedge_of: InflightRequest | None = None
+    ) -> tuple[str, str, Callable]:
+        """
+        解析模型、准入、租用会话、选择标签页并把请求发给油猴脚本
+        返回 (request_id, 模型名, finish)，调用方必须在响应结束后调用 finish(ok, 错误码)
+        hedge_of: 作为该请求的对冲副本发送，只使用空闲容量，换用别的会话和标签页
+        """
+        # 人机验证恢复期间暂停派发，恢复后放行的第一个请求作为探测
+        try:
+            probe = await self.recovery.wait_ready(hedge=hedge_of is not None)
+        except RecoveryPending as e:
+            raise HTTPException(
+                status_code=503,
+                detail=e.reason,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        try:
+            request_id, model_name, finish = await self._send_request(
+                openai_req, hedge_of
+            )
+        except BaseException:
+            if probe:
+                self.recovery.probe_finished(False)
+            raise
+        if probe:
+            self.inflight[request_id].probe = True
+        return request_id, model_name, finish
+
+    async def _send_request(
+        self, openai_req: dict, hedge_of: InflightRequest | None = None
+    ) -> tuple[str, str, Callable]:
+        """_submit 的派发部分"""
+        requested = openai_req.get("model")
+        resolved = self._resolve_model(requested)
+
+        if not self.workers:
+            raise HTTPException(
+                status_code=503,
+                detail="油猴脚本客户端未连接。请确保 LMArena 页面已打开并激活脚本。",
+            )
+
+        # 准入控制：超出容量时排队，队列满或排队超时快速返回 429
+        # 对冲请求不排队，没有空闲容量就放弃
+        if hedge_of:
+            if not self.admission.try_acquire():
+                raise HTTPException(status_code=429, detail="没有空闲容量")
+        else:
+            try:
+                await self.admission.acquire()
+            except AdmissionRejected as e:
                 raise HTTPException(
-                    status_code=401,
-                    detail="未提供 API Key。请在 Authorization 头部中以 'Bearer YOUR_KEY' 格式提供。",
+                    status_code=429,
+                    detail=e.reason,
+                    headers={"Retry-After": str(e.retry_after)},
                 )
-            provided_key = auth_header.split(" ")[1]
-            if provided_key != self.conf["bridge_server"]["api_key"]:
-                raise HTTPException(status_code=401, detail="提供的 API Key 不正确。")
+        admitted_at = time.monotonic()
+
+        # 租用会话
+        try:
+            slot = await self.sessions.acquire(
+                0 if hedge_of else self.conf["timeout"],
+                resolved[0] if resolved else None,
+                exclude=hedge_of.slot if hedge_of else None,
+            )
+        except (LookupError, asyncio.TimeoutError) as e:
+            self.admission.release()
+            detail = str(e) or "所有会话都在忙碌或冷却中"
+            raise HTTPException(status_code=503, detail=detail)
+        except BaseException:
+            # 等待会话时被取消（如客户端断开），同样要归还准入名额
+            self.admission.release()
+            raise
+
+        # 选择负载最低的标签页，对冲请求优先换一个标签页
+        worker = (hedge_of and self.workers.pick(exclude=hedge_of.worker)) or (
+            self.workers.pick()
+        )
+        if not worker:
+            await self.sessions.release(slot)
+            self.admission.release()
+            raise HTTPException(
+                status_code=503,
+                detail="油猴脚本客户端未连接。请确保 LMArena 页面已打开并激活脚本。",
+            )
+
+        # 未指定模型时按会话捕获时标记的模型处理
+        if not resolved and slot.model:
+            resolved = self.model_mgr.resolve(slot.model)
+        model_name, model_info = resolved or (requested or "default_model", {})
 
         # 生成请求ID
         request_id = str(uuid.uuid4())
 
-        # 创建响应通道
-        self.responser.channels[request_id] = asyncio.Queue()
-
-        # 发送载荷到油猴脚本
         payload = {
             "request_id": request_id,
             "payload": {
                 "message_templates": self.processor.openai_to_lmarena(openai_req),
-                "target_model_id": None, # fuck! 原来是个没作用的参数
-                "session_id": self.conf["session_id"],
-                "message_id": self.conf["message_id"],
+                "target_model_id": model_info.get("id"),
+                "is_image_request": model_info.get("type") == "image",
+                "session_id": slot.session_id,
+                "message_id": slot.message_id,
             },
         }
-        logger.debug(payload)
-        await self.ws_send(payload)
 
-        # 返回响应（stream 参数开启流式响应）
+        # 创建响应通道
+        self.responser.channels[request_id] = asyncio.Queue()
+        self.workers.assign(request_id, worker)
+        self.inflight[request_id] = InflightRequest(
+            request_id, slot, worker, payload, self.conf["timeout"]
+        )
+        if not hedge_of:
+            self.hedger.budget.deposit()
+
+        async def finish(ok: bool, code: str | None = None):
+            self.responser.channels.pop(request_id, None)
+            record = self.inflight.pop(request_id, None)
+            # 超时、客户端断开或提前出错时，浏览器端可能仍在生成
+            await self.cancel(request_id, "桥梁已不再等待该响应")
+            self.workers.release(request_id)
+            # 只有会话本身的错误才算会话失败
+            await self.sessions.release(slot, ok or code not in SESSION_ERRORS)
+            self.admission.release(time.monotonic() - admitted_at)
+            if record and record.probe:
+                self.recovery.probe_finished(ok)
+
+        # 发送载荷到油猴脚本
+        try:
+            await self.ws_send(payload, worker)
+        except BaseException:
+            # 发送失败或发送时被取消，都要释放已占用的通道、会话和准入名额
+            self.workers.release(request_id)
+            await finish(True)
+            raise
+        return request_id, model_name, finish
+
+    async def _complete(self, openai_req: dict) -> tuple[int, dict]:
+        """
+        非流式请求：提交并等待结果。
+        启用对冲时，首个请求超过最近首字节耗时的第 N 百分位仍无数据，
+        就在预算内向另一个会话/标签页发送副本，先成功者胜出，另一个被取消
+        """
+        request_id, model, finish = await self._submit(openai_req)
+        primary = asyncio.create_task(self._collect(request_id, model, finish))
+        tasks = [primary]
         try:
-            return await self.responser.non_stream_response(
-                request_id, "default_model"
+            record = self.inflight.get(request_id)
+            delay = self.hedger.delay() if self.hedger.enabled else None
+            if delay is None or record is None:
+                return await primary
+
+            waiter = asyncio.create_task(record.first_byte.wait())
+            try:
+                await asyncio.wait(
+                    {primary, waiter},
+                    timeout=delay,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                waiter.cancel()
+            if primary.done() or record.first_byte.is_set():
+                return await primary
+
+            if not self.hedger.budget.try_spend():
+                self.hedger.skipped_budget += 1
+                return await primary
+            try:
+                hedge_id, _, hedge_finish = await self._submit(
+                    openai_req, hedge_of=record
+                )
+            except HTTPException as e:
+                self.hedger.budget.refund()
+                logger.debug(f"对冲请求未发出: {e.detail}")
+                return await primary
+            self.hedger.hedged += 1
+            logger.info(
+                f"请求 {request_id[:8]} 超过 {delay:.1f}s 未收到数据，发出对冲请求 {hedge_id[:8]}"
             )
+            hedge = asyncio.create_task(self._collect(hedge_id, model, hedge_finish))
+            tasks.append(hedge)
+            return await self._race(primary, hedge)
+        finally:
+            # 调用方被取消（如客户端断开）时首个请求和对冲请求也不能留在后台，
+            # 取消并等它们通知浏览器、归还标签页和会话
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    async def _race(self, primary: asyncio.Task, hedge: asyncio.Task):
+        """返回先成功的结果并取消另一个；都失败时返回最后的错误"""
+        pending = {primary, hedge}
+        result: tuple[int, dict] | None = None
+        error: BaseException | None = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception():
+                        error = task.exception()
+                        continue
+                    result = task.result()
+                    if result[0] == 200:
+                        if task is hedge:
+                            self.hedger.hedge_wins += 1
+                        return result
+        finally:
+            for task in pending:
+                task.cancel()
+        if result is None and error:
+            raise error
+        assert result is not None
+        return result
+
+    async def _collect(
+        self, request_id: str, model: str, finish: Callable
+    ) -> tuple[int, dict]:
+        """等待非流式响应并释放资源"""
+        ok, code = False, None
+        try:
+            status_code, response_data = await self.responser.collect(request_id, model)
+            ok = status_code < 500
+            if not ok:
+                code = response_data.get("error", {}).get("code")
+            return status_code, response_data
         except Exception as e:
             logger.error(
                 f"API CALL [ID: {request_id[:8]}]: 处理请求时发生致命错误: {e}",
                 exc_info=True,
             )
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            await finish(ok, code)
+
+    async def get_models(self) -> dict:
+        """OpenAI 兼容的模型列表"""
+        return {
+            "object": "list",
+            "data": [
+                {
+                    "id": name,
+                    "object": "model",
+                    "created": 0,
+                    "owned_by": "lmarena",
+                    "type": info["type"],
+                }
+                for name, info in self.model_mgr.model_map.items()
+            ],
+        }
+
+    async def get_stats(self, request: Request) -> dict:
+        """桥梁运行状态"""
+        self._check_api_key(request)
+        return {
+            "workers": self.workers.stats(),
+            "sessions": self.sessions.stats(),
+            "admission": self.admission.stats(),
+            "hedging": self.hedger.stats(),
+            "recovery": self.recovery.stats(),
+            "replay": {"replayed": self.replayed, "failed": self.replay_failed},
+        }
 
     async def update_available_models_endpoint(self, request: Request):
         """
-        接收来自油猴脚本的页面 HTML，提取并更新 available_models.json。
+        接收来自油猴脚本的模型列表并更新 available_models.json：
+        新脚本在本地提取模型、比对摘要后才发送 JSON（可 gzip 压缩），
+        旧脚本发送整个页面 HTML
         """
-        html_content = await request.body()
-        if not html_content:
-            logger.warning("模型更新请求未收到任何 HTML 内容。")
+        body = await request.body()
+        if not body:
+            logger.warning("模型更新请求未收到任何内容。")
+            return
+        if request.headers.get("content-encoding") == "gzip":
+            try:
+                body = await asyncio.to_thread(_gunzip, body, MAX_MODELS_PAYLOAD)
+            except (ValueError, zlib.error) as e:
+                raise HTTPException(status_code=400, detail=f"解压失败: {e}")
+
+        if request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                models = json.loads(body)
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="无效的 JSON 请求体")
+            if not isinstance(models, list):
+                raise HTTPException(status_code=400, detail="模型列表格式错误")
+            logger.info(f"收到来自油猴脚本的模型列表（{len(body)} 字节）")
+            await self.model_mgr.update_models(models)
             return
+
         logger.info("收到来自油猴脚本的页面内容，开始提取可用模型...")
-        self.model_mgr.update_from_html(html_content.decode("utf-8"))
+        await self.model_mgr.update_from_html(body)
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from astrbot.api import logger
+from astrbot.core.config.astrbot_config import AstrBotConfig
+
+# 由会话本身引起的错误码，只有这些错误才让会话冷却、累计失败次数；
+# 内容审核、人机验证、超时、标签页断开等与会话无关
+SESSION_ERRORS = {"session_missing", "session_invalid"}
+
+
+class SessionSlot:
+    """
+    一对捕获到的 session_id / message_id，可标记捕获时页面上的模型
+    """
+
+    def __init__(self, session_id: str, message_id: str, model: str | None = None):
+        self.session_id = session_id
+        self.message_id = message_id
+        self.model = model or None
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.cooldown_until = 0.0
+        # 连续失败次数，成功一次即清零
+        self.failures = 0
+
+    @property
+    def key(self) -> str:
+        key = f"{self.session_id}:{self.message_id}"
+        return f"{key}:{self.model}" if self.model else key
+
+    def cooling(self, now: float) -> bool:
+        return now < self.cooldown_until
+
+
+class SessionPool:
+    """
+    会话池：每个请求租用一对会话ID，支持轮询/最久未用选择、单会话并发上限和出错冷却
+    """
+
+    # 连续失败达到该次数的会话将被移出会话池（池中只剩一个会话时保留）
+    max_failures = 5
+
+    def __init__(self, config: AstrBotConfig):
+        self.conf = config
+        self.slots: list[SessionSlot] = []
+        self._cursor = 0
+        self._cond = asyncio.Condition()
+        self._load()
+
+    # ---------------- 持久化 ----------------
+    def _load(self):
+        # 格式 session_id:message_id[:模型名]
+        for item in self.conf.get("session_pool", []):
+            if ":" in item:
+                sid, mid, *model = item.split(":", 2)
+                self._append(
+                    sid.strip(), mid.strip(), model[0].strip() if model else None
+                )
+        # 兼容旧版本：只捕获过一对会话ID
+        if (
+            not self.slots
+            and self.conf.get("session_id")
+            and self.conf.get("message_id")
+        ):
+            self._append(self.conf["session_id"], self.conf["message_id"])
+
+    def _save(self):
+        self.conf["session_pool"] = [slot.key for slot in self.slots]
+        self.conf.save_config()
+
+    def _append(
+        self, session_id: str, message_id: str, model: str | None = None
+    ) -> bool:
+        for s in self.slots:
+            if s.session_id == session_id and s.message_id == message_id:
+                # 重新捕获同一会话时更新模型标记
+                changed = s.model != (model or None)
+                s.model = model or None
+                return changed
+        self.slots.append(SessionSlot(session_id, message_id, model))
+        return True
+
+    def add(self, session_id: str, message_id: str, model: str | None = None) -> bool:
+        """加入新捕获的会话（或更新其模型标记），没有变化时返回 False"""
+        added = self._append(session_id, message_id, model)
+        if added:
+            self._save()
+            tag = f"（{model}）" if model else ""
+            logger.info(
+                f"会话池新增 {session_id[:8]}{tag}，当前共 {len(self.slots)} 个会话"
+            )
+        return added
+
+    def remove(self, slot: SessionSlot):
+        if slot in self.slots:
+            self.slots.remove(slot)
+            self._save()
+            logger.warning(
+                f"会话 {slot.session_id[:8]} 连续失败 {slot.failures} 次，已移出会话池"
+            )
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    # ---------------- 租用 ----------------
+    def _candidates(self, model: str | None) -> list[SessionSlot]:
+        """
+        优先使用标记为该模型的会话，其次是未标记的会话，都没有时使用全部会话
+        （请求会带上目标模型ID，任意会话都能切换模型）
+        """
+        for wanted in (model, None):
+            if slots := [s for s in self.slots if s.model == wanted]:
+                return slots
+        return self.slots
+
+    def _select(
+        self,
+        now: float,
+        model: str | None = None,
+        exclude: SessionSlot | None = None,
+    ) -> SessionSlot | None:
+        limit = self.conf.get("session_max_concurrency", 0)
+        available = [
+            s
+            for s in self._candidates(model)
+            if s is not exclude
+            and not s.cooling(now)
+            and (limit <= 0 or s.in_flight < limit)
+        ]
+        if not available:
+            return None
+        if self.conf.get("session_strategy", "lru") == "round_robin":
+            for _ in range(len(self.slots)):
+                slot = self.slots[self._cursor % len(self.slots)]
+                self._cursor += 1
+                if slot in available:
+                    return slot
+        return min(available, key=lambda s: (s.in_flight, s.last_used))
+
+    async def acquire(
+        self,
+        timeout: float,
+        model: str | None = None,
+        exclude: SessionSlot | None = None,
+    ) -> SessionSlot:
+        """
+        租用一个会话（优先匹配 model，跳过 exclude），超时抛出 asyncio.TimeoutError
+        """
+        if not self.slots:
+            raise LookupError("会话池为空，请先捕获会话ID")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with self._cond:
+            while True:
+                now = time.monotonic()
+                if slot := self._select(now, model, exclude):
+                    slot.in_flight += 1
+                    slot.last_used = now
+                    return slot
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                # 冷却到期或新会话加入不会触发 notify，定期醒来重新检查
+                try:
+                    await asyncio.wait_for(self._cond.wait(), min(remaining, 1))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, slot: SessionSlot, ok: bool = True):
+        """归还会话；ok=False 表示会话本身出了问题，进入冷却"""
+        slot.in_flight = max(0, slot.in_flight - 1)
+        if ok:
+            slot.failures = 0
+        else:
+            slot.failures += 1
+            slot.cooldown_until = time.monotonic() + self.conf.get(
+                "session_cooldown", 30
+            )
+            # 不自动移除最后一个会话，否则只能重新捕获
+            if slot.failures >= self.max_failures and len(self.slots) > 1:
+                self.remove(slot)
+        async with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "session_id": s.session_id,
+                "model": s.model,
+                "in_flight": s.in_flight,
+                "failures": s.failures,
+                "cooling": s.cooling(now),
+            }
+            for s in self.slots
+        ]
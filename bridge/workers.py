@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+import uuid
+from fastapi import WebSocket
+from astrbot.api import logger
+
+
+class BrowserWorker:
+    """
+    单个油猴脚本连接（一个浏览器标签页）
+    """
+
+    def __init__(self, ws: WebSocket):
+        self.id = uuid.uuid4().hex[:8]
+        self.ws = ws
+        self.connected_at = time.monotonic()
+        # 握手后确定的协议版本和脚本版本，旧版脚本不握手
+        self.protocol = 1
+        self.version: str | None = None
+        # 脚本在握手时声明的并发上限（超出的请求在浏览器里排队），旧版脚本为 None
+        self.max_concurrency: int | None = None
+        # 所有发往该标签页的消息都由一个发送任务按顺序写出
+        self._outbox: asyncio.Queue[tuple[str, asyncio.Future]] = asyncio.Queue()
+        self._sender: asyncio.Task | None = None
+        # 正在由该标签页处理的请求ID
+        self.in_flight: set[str] = set()
+        # 其中浏览器已发回 [DONE] 的请求
+        self.finished: set[str] = set()
+        # 已通知取消、等待浏览器收尾的请求，其后续消息直接丢弃
+        self.cancelled: set[str] = set()
+        # 已处理的请求数，用于负载相同时的平衡
+        self.served = 0
+        # 出现 Cloudflare 验证、发送失败等情况时标记为不健康，重连后恢复
+        self.healthy = True
+        # 油猴脚本上报的耗时（毫秒，指数滑动平均）
+        self.queued_ms: float | None = None
+        self.ttfb_ms: float | None = None
+        self.total_ms: float | None = None
+
+    @property
+    def load(self) -> int:
+        return len(self.in_flight)
+
+    def limit(self, configured: int = 0) -> int | None:
+        """该标签页的在途请求上限：配置值与脚本声明值中较小的一个，都没有时为 None"""
+        limits = [n for n in (configured, self.max_concurrency) if n and n > 0]
+        return min(limits) if limits else None
+
+    @property
+    def has_room(self) -> bool:
+        """未达到脚本声明的并发上限，再派发不会在浏览器里排队"""
+        return self.max_concurrency is None or self.load < self.max_concurrency
+
+    def start(self):
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def stop(self):
+        if self._sender:
+            self._sender.cancel()
+            self._sender = None
+        while not self._outbox.empty():
+            _, future = self._outbox.get_nowait()
+            if not future.done():
+                future.set_exception(ConnectionError("标签页已断开"))
+
+    async def send(self, payload: dict):
+        """序列化后交给发送任务，等待写出完成（失败时抛出异常）"""
+        if not self._sender:
+            raise ConnectionError("标签页已断开")
+        text = json.dumps(payload, ensure_ascii=False)
+        logger.debug(f"[本地->油猴 {self.id}]: {text[:200]}...")
+        future = asyncio.get_running_loop().create_future()
+        self._outbox.put_nowait((text, future))
+        await future
+
+    async def _send_loop(self):
+        while True:
+            text, future = await self._outbox.get()
+            if future.done():
+                continue
+            try:
+                await self.ws.send_text(text)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            # 等待方可能在写出期间被取消
+            if not future.done():
+                future.set_result(None)
+
+    def record_timing(self, timing: dict):
+        """记录油猴脚本上报的单个请求耗时 {queued_ms, ttfb_ms, total_ms, ok}"""
+        for name in ("queued_ms", "ttfb_ms", "total_ms"):
+            value = timing.get(name)
+            if not isinstance(value, (int, float)):
+                continue
+            old = getattr(self, name)
+            setattr(self, name, value if old is None else old * 0.8 + value * 0.2)
+
+    def __repr__(self) -> str:
+        return f"<BrowserWorker {self.id} load={self.load} healthy={self.healthy}>"
+
+
+class WorkerPool:
+    """
+    已连接油猴脚本的注册表，按最少在途请求数分派
+    """
+
+    def __init__(self):
+        self.workers: dict[str, BrowserWorker] = {}
+        # request_id -> 负责该请求的 worker
+        self.owners: dict[str, BrowserWorker] = {}
+
+    def __len__(self) -> int:
+        return len(self.workers)
+
+    def add(self, ws: WebSocket) -> BrowserWorker:
+        worker = BrowserWorker(ws)
+        worker.start()
+        self.workers[worker.id] = worker
+        logger.info(f"标签页 {worker.id} 已加入，当前连接数: {len(self.workers)}")
+        return worker
+
+    def remove(self, worker: BrowserWorker) -> set[str]:
+        """移除 worker，返回它名下尚未完成的请求ID"""
+        self.workers.pop(worker.id, None)
+        worker.stop()
+        # 已收到 [DONE] 的请求数据已经完整，不算在内
+        orphaned = worker.in_flight - worker.finished
+        for request_id in orphaned:
+            self.owners.pop(request_id, None)
+        worker.in_flight.clear()
+        worker.finished.clear()
+        worker.cancelled.clear()
+        logger.info(f"标签页 {worker.id} 已移除，当前连接数: {len(self.workers)}")
+        return orphaned
+
+    def healthy_count(self) -> int:
+        """健康的 worker 数，可在其他线程中调用"""
+        return sum(1 for w in list(self.workers.values()) if w.healthy)
+
+    def pick(self, exclude: BrowserWorker | None = None) -> BrowserWorker | None:
+        """选出在途请求最少的健康 worker"""
+        healthy = [w for w in self.workers.values() if w.healthy and w is not exclude]
+        if not healthy:
+            return None
+        # 优先选择还没达到声明并发上限的标签页
+        return min(healthy, key=lambda w: (not w.has_room, w.load, w.served))
+
+    def assign(self, request_id: str, worker: BrowserWorker):
+        worker.in_flight.add(request_id)
+        worker.served += 1
+        self.owners[request_id] = worker
+
+    def release(self, request_id: str):
+        if worker := self.owners.pop(request_id, None):
+            worker.in_flight.discard(request_id)
+            worker.finished.discard(request_id)
+
+    def running(self, request_id: str) -> BrowserWorker | None:
+        """浏览器仍在执行该请求时返回负责它的 worker"""
+        worker = self.owners.get(request_id)
+        if worker and request_id not in worker.finished:
+            return worker
+        return None
+
+    def owner_of(self, request_id: str) -> BrowserWorker | None:
+        return self.owners.get(request_id)
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "id": w.id,
+                "load": w.load,
+                "served": w.served,
+                "healthy": w.healthy,
+                "protocol": w.protocol,
+                "version": w.version,
+                "max_concurrency": w.max_concurrency,
+                "queued_ms": w.queued_ms,
+                "ttfb_ms": w.ttfb_ms,
+                "total_ms": w.total_ms,
+            }
+            for w in self.workers.values()
+        ]
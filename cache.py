@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from astrbot.api import logger
+
+
+def content_digest(data: bytes | str) -> str:
+    """内容哈希（sha256 十六进制）"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    生成结果缓存：以 (模型, 提示词, 输入图片哈希) 为键，
+    内存 LRU + 磁盘两级，支持 TTL 和容量淘汰（内存按条数和字节数双重限制）
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        ttl: float,
+        memory_items: int = 64,
+        disk_bytes: int = 256 * 1024 * 1024,
+        memory_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        # key -> (过期时间, 结果, 大小)
+        self._memory: OrderedDict[str, tuple[float, bytes | str, int]] = OrderedDict()
+        self._memory_size = 0
+        # key -> (文件路径, 大小)，按访问顺序排列
+        self._disk: OrderedDict[str, tuple[Path, int]] = OrderedDict()
+        self._disk_size = 0
+        # 磁盘读写在线程池中进行，索引需要加锁
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._scan_disk()
+
+    @staticmethod
+    def make_key(model: str, text: str, image_digests: list[str]) -> str:
+        raw = "\x00".join([model, text, *image_digests])
+        return content_digest(raw)
+
+    # ---------------- 磁盘索引 ----------------
+    def _scan_disk(self):
+        """启动时重建磁盘索引，按修改时间从旧到新排列"""
+        files = sorted(
+            (p for p in self.cache_dir.iterdir() if p.suffix in (".bin", ".txt")),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for path in files:
+            size = path.stat().st_size
+            self._disk[path.stem] = (path, size)
+            self._disk_size += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk and self._disk_size > self.disk_bytes:
+            _, (path, size) = self._disk.popitem(last=False)
+            self._disk_size -= size
+            path.unlink(missing_ok=True)
+
+    def _read_disk(self, key: str) -> tuple[bytes | str, float] | None:
+        with self._lock:
+            return self._read_disk_locked(key)
+
+    def _read_disk_locked(self, key: str) -> tuple[bytes | str, float] | None:
+        """返回 (结果, 过期时间)"""
+        entry = self._disk.get(key)
+        if not entry:
+            return None
+        path, size = entry
+        try:
+            expires_at = path.stat().st_mtime + self.ttl
+        except FileNotFoundError:
+            expires_at = 0
+        if expires_at <= time.time():
+            self._disk.pop(key, None)
+            self._disk_size -= size
+            path.unlink(missing_ok=True)
+            return None
+        self._disk.move_to_end(key)
+        if path.suffix == ".txt":
+            return path.read_text(encoding="utf-8"), expires_at
+        return path.read_bytes(), expires_at
+
+    def _write_disk(self, key: str, value: bytes | str):
+        with self._lock:
+            self._write_disk_locked(key, value)
+
+    def _write_disk_locked(self, key: str, value: bytes | str):
+        is_text = isinstance(value, str)
+        path = self.cache_dir / f"{key}.{'txt' if is_text else 'bin'}"
+        data = value.encode("utf-8") if is_text else value
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        if old := self._disk.pop(key, None):
+            self._disk_size -= old[1]
+        self._disk[key] = (path, len(data))
+        self._disk_size += len(data)
+        self._evict_disk()
+
+    # ---------------- 对外接口 ----------------
+    async def get(self, key: str) -> bytes | str | None:
+        now = time.time()
+        if entry := self._memory.get(key):
+            expires_at, value, _ = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            self._pop_memory(key)
+
+        try:
+            found = await asyncio.to_thread(self._read_disk, key)
+        except OSError as e:
+            logger.warning(f"读取结果缓存失败: {e}")
+            found = None
+        if found is None:
+            self.misses += 1
+            return None
+        value, expires_at = found
+        self._put_memory(key, value, expires_at)
+        self.hits += 1
+        return value
+
+    def _put_memory(self, key: str, value: bytes | str, expires_at: float):
+        self._pop_memory(key)
+        size = len(value.encode("utf-8") if isinstance(value, str) else value)
+        # 单个结果超过内存上限时只存磁盘
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = (expires_at, value, size)
+        self._memory_size += size
+        while self._memory and (
+            len(self._memory) > self.memory_items
+            or self._memory_size > self.memory_bytes
+        ):
+            _, (_, _, evicted) = self._memory.popitem(last=False)
+            self._memory_size -= evicted
+
+    def _pop_memory(self, key: str):
+        if entry := self._memory.pop(key, None):
+            self._memory_size -= entry[2]
+
+    async def put(self, key: str, value: bytes | str):
+        self._put_memory(key, value, time.time() + self.ttl)
+        try:
+            await asyncio.to_thread(self._write_disk, key, value)
+        except OSError as e:
+            logger.warning(f"写入结果缓存失败: {e}")
+
+
+class PreparedImage:
+    """
+    一张输入图片的预处理产物
+    """
+
+    def __init__(self, digest: str, data: bytes):
+        self.digest = digest
+        # 抽帧后的原始字节
+        self.data = data
+        # 图床 URL 及其过期时间（0 表示不过期）
+        self.url: str | None = None
+        self.url_expires_at = 0.0
+        # max_bytes -> 压缩后的字节
+        self.compressed: dict[int, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.data) + sum(len(b) for b in self.compressed.values())
+
+    def valid_url(self) -> str | None:
+        if self.url and (not self.url_expires_at or self.url_expires_at > time.time()):
+            return self.url
+        return None
+
+
+class ImagePrepCache:
+    """
+    输入图片预处理缓存：按内容哈希复用抽帧/压缩结果和图床 URL，按内存占用做 LRU 淘汰
+    """
+
+    def __init__(self, max_bytes: int, source_ttl: float = 3600, url_ttl: float = 0):
+        """
+        max_bytes: 缓存字节上限，0 表示不缓存
+        source_ttl: 来源(URL/头像) -> 内容哈希 的有效期，过期后重新下载
+        url_ttl: 图床 URL 的有效期，应小于图床的清理间隔，0 表示不过期
+        """
+        self.max_bytes = max_bytes
+        self.source_ttl = source_ttl
+        self.url_ttl = url_ttl
+        self._items: OrderedDict[str, PreparedImage] = OrderedDict()
+        self._size = 0
+        # 来源 -> (内容哈希, 过期时间)
+        self._sources: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        # 图床 URL -> 内容哈希
+        self._urls: dict[str, str] = {}
+        self.hits = 0
+
+    def source_digest(self, source: str) -> str | None:
+        if entry := self._sources.get(source):
+            digest, expires_at = entry
+            if expires_at > time.time() and digest in self._items:
+                return digest
+            self._sources.pop(source, None)
+        return None
+
+    def remember_source(self, source: str, digest: str):
+        self._sources[source] = (digest, time.time() + self.source_ttl)
+        self._sources.move_to_end(source)
+        while len(self._sources) > 4096:
+            self._sources.popitem(last=False)
+
+    def url_digest(self, url: str) -> str | None:
+        return self._urls.get(url)
+
+    def get(self, digest: str) -> PreparedImage | None:
+        if item := self._items.get(digest):
+            self._items.move_to_end(digest)
+            self.hits += 1
+            return item
+        return None
+
+    def put(self, digest: str, data: bytes) -> PreparedImage:
+        item = PreparedImage(digest, data)
+        if self.max_bytes > 0:
+            self._items[digest] = item
+            self._size += item.size
+            self._evict()
+        return item
+
+    def set_url(self, item: PreparedImage, url: str):
+        if item.url and item.url != url:
+            self._urls.pop(item.url, None)
+        item.url = url
+        item.url_expires_at = time.time() + self.url_ttl if self.url_ttl else 0
+        # 只记录缓存中的图片，淘汰时一并移除，否则 _urls 会无限增长
+        if item.digest in self._items:
+            self._urls[url] = item.digest
+
+    def set_compressed(self, item: PreparedImage, max_bytes: int, data: bytes):
+        if item.digest in self._items:
+            self._size -= item.size
+            item.compressed[max_bytes] = data
+            self._size += item.size
+            self._evict()
+        else:
+            item.compressed[max_bytes] = data
+
+    def _evict(self):
+        while self._items and self._size > self.max_bytes:
+            _, item = self._items.popitem(last=False)
+            self._size -= item.size
+            if item.url:
+                self._urls.pop(item.url, None)
@@ -1,16 +1,34 @@
 import asyncio
 import base64
-import shutil
+import hashlib
+import re
 import threading
+import time
+import uuid
+from collections import OrderedDict
 from pathlib import Path
-from fastapi import Body, FastAPI, HTTPException, Request
-from fastapi.staticfiles import StaticFiles
+from fastapi import Body, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 import uvicorn
 from astrbot.api import logger
 from astrbot.core.config.astrbot_config import AstrBotConfig
+from .imaging import sniff_mime
 
 
+# 按文件头判断的类型 -> 扩展名
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+MEDIA_TYPES = {ext: mime for mime, ext in EXTENSIONS.items()} | {".jpeg": "image/jpeg"}
+# 内容寻址文件名（sha256）
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+# 写盘批次大小
+WRITE_CHUNK = 1024 * 1024
+
 
 class UploadPayload(BaseModel):
     file_name: str
@@ -18,24 +36,156 @@ class UploadPayload(BaseModel):
     api_key: str
 
 
+class UploadIndex:
+    """
+    图床文件索引：记录每个文件的大小和最后访问时间，
+    按 TTL 和总容量逐批淘汰最久未访问的文件，新上传或刚被复用的文件在 min_age 内不会被淘汰
+    """
+
+    def __init__(self, upload_dir: Path, ttl: float, max_bytes: int, min_age: float):
+        """
+        ttl: 最后一次访问后的保留时长(秒)，0 表示不按时间淘汰
+        max_bytes: 总容量上限，0 表示不限制
+        min_age: 上传或复用后的最短保留时长(秒)
+        """
+        self.upload_dir = upload_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        # 文件名 -> (大小, 上传或最近一次复用的时间, 最后访问时间)，按最后访问时间排列
+        self._files: OrderedDict[str, tuple[int, float, float]] = OrderedDict()
+        self._size = 0
+        # 上传、访问在 uvicorn 线程，淘汰在插件主循环的线程池
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def scan(self):
+        """启动时从磁盘重建索引"""
+        entries = []
+        for path in self.upload_dir.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+        entries.sort()
+        with self._lock:
+            for mtime, name, size in entries:
+                self._files[name] = (size, mtime, mtime)
+                self._size += size
+
+    def add(self, src: Path, name: str, size: int):
+        """把写好的临时文件移到 name 并登记；与淘汰时的删除互斥，新文件不会被误删"""
+        now = time.time()
+        with self._lock:
+            src.replace(self.upload_dir / name)
+            if old := self._files.pop(name, None):
+                self._size -= old[0]
+            self._files[name] = (size, now, now)
+            self._size += size
+
+    def touch(self, name: str):
+        with self._lock:
+            if entry := self._files.get(name):
+                self._files[name] = (entry[0], entry[1], time.time())
+                self._files.move_to_end(name)
+
+    def claim(self, name: str) -> bool:
+        """
+        复用已有文件：查找和刷新在同一把锁内完成，返回 True 时文件至少再保留 min_age，
+        调用方拿到的 URL 不会在下一刻因淘汰而 404
+        """
+        with self._lock:
+            entry = self._files.get(name)
+            if not entry:
+                return False
+            now = time.time()
+            self._files[name] = (entry[0], now, now)
+            self._files.move_to_end(name)
+            return True
+
+    def _pick(self, limit: int) -> list[str]:
+        """从最久未访问的文件开始挑选需要淘汰的文件（需持有锁）"""
+        now = time.time()
+        victims: list[str] = []
+        freed = 0
+        for name, (size, created, accessed) in self._files.items():
+            if len(victims) >= limit:
+                break
+            over = self.max_bytes and self._size - freed > self.max_bytes
+            expired = self.ttl and now - accessed > self.ttl
+            if not (over or expired):
+                # 之后的文件访问时间更晚，既没超容量也不会过期
+                break
+            if now - created < self.min_age:
+                continue
+            victims.append(name)
+            freed += size
+        return victims
+
+    def evict_batch(self, limit: int = 64) -> int:
+        """淘汰一批文件，返回淘汰数量（阻塞，需在线程中执行）"""
+        with self._lock:
+            victims = [(name, self._files.pop(name)) for name in self._pick(limit)]
+            for _, (size, _, _) in victims:
+                self._size -= size
+        for name, _ in victims:
+            with self._lock:
+                # 挑出后又被重新上传的文件不能删
+                if name in self._files:
+                    continue
+                try:
+                    (self.upload_dir / name).unlink(missing_ok=True)
+                except OSError as e:
+                    logger.warning(f"[图床] 删除 {name} 失败: {e}")
+        self.evicted += len(victims)
+        return len(victims)
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._files),
+            "bytes": self._size,
+            "evicted": self.evicted,
+        }
+
+
 class ImageServer:
+    # 淘汰检查间隔(秒)和单批数量
+    EVICT_INTERVAL = 60
+    EVICT_BATCH = 64
+
     def __init__(self, config: AstrBotConfig, upload_dir: Path):
         self.clear_cache_interval = config["image_server"]["clear_cache_interval"]
+        self.max_cache_bytes = (
+            config["image_server"].get("max_cache_mb", 1024) * 1024 * 1024
+        )
         self.host = config["image_server"]["host"]
         self.port = config["image_server"]["port"]
         self.api_key = config["image_server"]["api_key"]
+        self.max_upload_bytes = (
+            config["image_server"].get("max_upload_mb", 20) * 1024 * 1024
+        )
         self.upload_dir = upload_dir
+        self.index = UploadIndex(
+            upload_dir,
+            ttl=self.clear_cache_interval * 3600,
+            max_bytes=self.max_cache_bytes,
+            min_age=config["image_server"].get("min_keep_minutes", 30) * 60,
+        )
+        self.index.scan()
         self.app = FastAPI()
         self._server = None
         self._thread = None
         self._cleaner_thread = None
         self._stop_cleaner = threading.Event()
-        self.app.mount(
-            "/uploads", StaticFiles(directory=self.upload_dir), name="uploads"
-        )
         self._setup_routes()
 
     def _setup_routes(self):
+        @self.app.middleware("http")
+        async def track_access(request: Request, call_next):
+            # 记录访问时间，最近被访问的文件最后淘汰
+            if request.url.path.startswith("/uploads/"):
+                self.index.touch(request.url.path.removeprefix("/uploads/"))
+            return await call_next(request)
+
         @self.app.post("/upload")
         async def upload(request: Request, payload: UploadPayload = Body(...)):
             # 校验 API key
@@ -49,32 +199,218 @@ class ImageServer:
                 base64_str = payload.file_data
             file_bytes = base64.b64decode(base64_str)
 
-            # 保存文件
-            save_path = self.upload_dir / payload.file_name
-            with open(save_path, "wb") as f:
-                f.write(file_bytes)
+            # 保存文件（按内容命名，重复上传不会再次写盘）
+            file_name = await asyncio.to_thread(self.save_upload, file_bytes)
 
             client_host = request.client.host if request.client else "unknown"
-            logger.info(f"[图床] (来自 {client_host})上传完成，已保存到: {save_path}")
+            logger.info(f"[图床] (来自 {client_host})上传完成: {file_name}")
 
-            return {"success": True, "filename": payload.file_name}
+            return {"success": True, "filename": file_name}
+
+        @self.app.post("/upload/raw")
+        async def upload_raw(
+            request: Request,
+            x_api_key: str = Header(""),
+            x_content_sha256: str = Header(""),
+        ):
+            """
+            请求体即图片原始字节，分块写入磁盘，不经过 base64。
+            带 X-Content-SHA256 且图床上已有该内容时直接返回，不读取请求体
+            """
+            if self.api_key and x_api_key != self.api_key:
+                raise HTTPException(403)
+            # 索引锁可能被淘汰线程占用，查找和落盘都在线程中进行
+            if existing := await asyncio.to_thread(
+                self._find_digest, x_content_sha256.lower()
+            ):
+                return {"success": True, "filename": existing, "exists": True}
+            content_length = int(request.headers.get("content-length") or 0)
+            if self.max_upload_bytes and content_length > self.max_upload_bytes:
+                raise HTTPException(413, "文件过大")
 
-    def _clear_cache(self):
+            tmp_path = self.upload_dir / f".{uuid.uuid4().hex}.part"
+            hasher = hashlib.sha256()
+            head = b""
+            size = 0
+            buffer = bytearray()
+            try:
+                f = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    async for chunk in request.stream():
+                        size += len(chunk)
+                        if self.max_upload_bytes and size > self.max_upload_bytes:
+                            raise HTTPException(413, "文件过大")
+                        if len(head) < 16:
+                            head += chunk[:16]
+                        hasher.update(chunk)
+                        buffer += chunk
+                        if len(buffer) >= WRITE_CHUNK:
+                            await asyncio.to_thread(f.write, bytes(buffer))
+                            buffer.clear()
+                    if buffer:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                finally:
+                    await asyncio.to_thread(f.close)
+                if not size:
+                    raise HTTPException(400, "空文件")
+                file_name = self._content_name(hasher.hexdigest(), head)
+                await asyncio.to_thread(self._store_upload, tmp_path, file_name, size)
+            finally:
+                await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+
+            client_host = request.client.host if request.client else "unknown"
+            logger.info(f"[图床] (来自 {client_host})上传完成: {file_name}")
+            return {"success": True, "filename": file_name}
+
+        @self.app.api_route("/uploads/{file_name}", methods=["GET", "HEAD"])
+        async def serve(file_name: str, request: Request):
+            return await self._serve(file_name, request)
+
+    @staticmethod
+    def _content_name(digest: str, head: bytes) -> str:
+        """内容寻址文件名：sha256 + 按文件头判断的扩展名"""
+        return digest + EXTENSIONS.get(sniff_mime(head), ".bin")
+
+    def _find_digest(self, digest: str) -> str | None:
+        """按内容哈希查找已存在的文件，找到时刷新其保留时间"""
+        if not DIGEST_RE.fullmatch(digest):
+            return None
+        for ext in (*EXTENSIONS.values(), ".bin"):
+            if self.index.claim(digest + ext):
+                return digest + ext
+        return None
+
+    def _store_upload(self, tmp_path: Path, file_name: str, size: int):
+        """把写好的临时文件登记为 file_name，已有相同内容时复用（阻塞）"""
+        if not self.index.claim(file_name):
+            self.index.add(tmp_path, file_name, size)
+
+    def save_upload(self, data: bytes) -> str:
+        """
+        保存上传的图片，按内容哈希命名，已存在时不再写盘，返回文件名。
+        与插件同进程时由 Workflow 直接调用（阻塞，需在线程中执行）
+        """
+        file_name = self._content_name(hashlib.sha256(data).hexdigest(), data[:16])
+        if self.index.claim(file_name):
+            return file_name
+        tmp_path = self.upload_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            tmp_path.write_bytes(data)
+            self.index.add(tmp_path, file_name, len(data))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        logger.debug(f"[图床] 上传完成，已保存到: {self.upload_dir / file_name}")
+        return file_name
+
+    async def _serve(self, file_name: str, request: Request) -> Response:
+        """
+        读取图片：内容寻址的文件带强 ETag 和 immutable 缓存头，
+        支持 If-None-Match 条件请求和单段 Range 请求
+        """
+        if file_name.startswith(".") or "/" in file_name or "\\" in file_name:
+            raise HTTPException(404)
+        path = self.upload_dir / file_name
         try:
-            if self.upload_dir.exists():
-                shutil.rmtree(self.upload_dir)
-            self.upload_dir.mkdir(parents=True, exist_ok=True)
-            logger.info("[图床] 定时清理完成，缓存已清空")
-        except Exception as e:
-            logger.error(f"[图床] 清理缓存失败: {e}")
-
-    def _start_cleaner(self, interval_hours: int = 6):
+            stat = await asyncio.to_thread(path.stat)
+        except OSError:
+            raise HTTPException(404)
+        stem = path.stem
+        if DIGEST_RE.fullmatch(stem):
+            etag = f'"{stem}"'
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            # 旧的随机文件名，内容不保证不变
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            cache_control = "public, max-age=3600"
+        headers = {
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Accept-Ranges": "bytes",
+        }
+        media_type = MEDIA_TYPES.get(path.suffix, "application/octet-stream")
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+
+        size = stat.st_size
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (not if_range or if_range.strip() == etag):
+            span = self._parse_range(range_header, size)
+            if span is None:
+                return Response(
+                    status_code=416,
+                    headers={**headers, "Content-Range": f"bytes */{size}"},
+                )
+            start, end = span
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            if request.method == "HEAD":
+                headers["Content-Length"] = str(end - start + 1)
+                return Response(status_code=206, headers=headers, media_type=media_type)
+            body = await asyncio.to_thread(self._read_range, path, start, end)
+            return Response(
+                body, status_code=206, headers=headers, media_type=media_type
+            )
+
+        return FileResponse(
+            path, headers=headers, media_type=media_type, stat_result=stat
+        )
+
+    @staticmethod
+    def _parse_range(value: str, size: int) -> tuple[int, int] | None:
+        """解析单段 Range 头，返回闭区间 (start, end)，不满足时返回 None"""
+        unit, _, spec = value.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        first, _, last = spec.strip().partition("-")
+        try:
+            if not first:
+                # bytes=-N：最后 N 个字节
+                length = int(last)
+                if length <= 0:
+                    return None
+                return max(0, size - length), size - 1
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if start >= size or end < start:
+            return None
+        return start, min(end, size - 1)
+
+    @staticmethod
+    def _read_range(path: Path, start: int, end: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def has_upload(self, file_name: str) -> bool:
+        """文件是否仍在图床上（未被淘汰），是则刷新保留时间以便继续使用其 URL"""
+        return self.index.claim(file_name)
+
+    def _start_cleaner(self):
         async def _loop():
             try:
                 while not self._stop_cleaner.is_set():
-                    await asyncio.sleep(interval_hours * 3600)
-                    if not self._stop_cleaner.is_set():
-                        self._clear_cache()
+                    await asyncio.sleep(self.EVICT_INTERVAL)
+                    # 小批量淘汰，批次之间让出事件循环，避免集中删除造成卡顿
+                    total = 0
+                    while not self._stop_cleaner.is_set():
+                        n = await asyncio.to_thread(
+                            self.index.evict_batch, self.EVICT_BATCH
+                        )
+                        total += n
+                        if n < self.EVICT_BATCH:
+                            break
+                        await asyncio.sleep(0.1)
+                    if total:
+                        logger.info(
+                            f"[图床] 已淘汰 {total} 个文件，当前 {self.index.stats()}"
+                        )
             except asyncio.CancelledError:
                 logger.info("[图床] 缓存清理任务已取消")
 
@@ -89,8 +425,8 @@ class ImageServer:
         self._server = uvicorn.Server(config)
         self._thread = threading.Thread(target=self._server.run, daemon=True)
         self._thread.start()
-        if self.clear_cache_interval:
-            self._start_cleaner(interval_hours=self.clear_cache_interval)
+        if self.clear_cache_interval or self.max_cache_bytes:
+            self._start_cleaner()
         logger.info(f"内置图床已启动: http://{self.host}:{self.port}")
 
     def stop(self):
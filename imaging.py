@@ -0,0 +1,178 @@
+"""
+图片处理：GIF 抽帧、压缩。
+
+本模块只依赖标准库和 PIL，压缩任务在独立的进程池中执行，子进程导入本模块的开销很小。
+"""
+
+import asyncio
+import io
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+
+# 压缩后的长边上限
+MAX_SIDE = 1024
+# 质量搜索范围
+QUALITY_MAX = 85
+QUALITY_MIN = 40
+
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0
+
+
+def sniff_mime(data: bytes) -> str:
+    """根据文件头判断图片类型"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def extract_first_frame(raw: bytes) -> bytes:
+    """把 GIF 的第一帧抽出来，返回 PNG/JPEG 字节流"""
+    img_io = io.BytesIO(raw)
+    img = Image.open(img_io)
+    if img.format != "GIF":
+        return raw  # 不是 GIF，原样返回
+    first_frame = img.convert("RGBA")
+    out_io = io.BytesIO()
+    first_frame.save(out_io, format="PNG")
+    return out_io.getvalue()
+
+
+def _resize(img: Image.Image, scale: float) -> Image.Image:
+    if scale >= 1:
+        return img
+    w, h = img.size
+    return img.resize(
+        (max(1, int(w * scale)), max(1, int(h * scale))), Image.Resampling.LANCZOS
+    )
+
+
+def _encode(img: Image.Image, scale: float, quality: int, fmt: str) -> bytes:
+    img = _resize(img, scale)
+    out = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def compress_sync(
+    image_bytes: bytes, max_bytes: int, fmt: str = "JPEG"
+) -> tuple[bytes, int]:
+    """
+    把静态图片压缩到 max_bytes 以内，GIF 不处理。返回 (结果, 编码次数)。
+
+    先按长边上限缩放并以最高质量编码一次；超出时用“体积与像素数成正比”的模型
+    估算缩放比例，再在该尺寸上对质量做二分查找，编码次数有上界。
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == "GIF" or len(image_bytes) <= max_bytes:
+        return image_bytes, 0
+
+    fmt = fmt.upper()
+    # JPEG 可以在解码时直接按 1/2、1/4、1/8 降采样，省掉大图的完整解码
+    if img.format == "JPEG":
+        img.draft("RGB", (MAX_SIDE, MAX_SIDE))
+    if fmt == "WEBP":
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    elif img.mode != "RGB":
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+
+    # 先缩放到长边上限，后续各次缩放都基于这张较小的底图
+    if max(img.size) > MAX_SIDE:
+        img.thumbnail((MAX_SIDE, MAX_SIDE), Image.Resampling.LANCZOS)
+    encodes = 0
+    scale = 1.0
+
+    # 1) 最高质量试一次
+    out = _encode(img, scale, QUALITY_MAX, fmt)
+    encodes += 1
+    if len(out) <= max_bytes:
+        return out, encodes
+
+    # 2) 最低质量仍超出时，按体积模型缩小尺寸（最多 4 次）
+    low = _encode(img, scale, QUALITY_MIN, fmt)
+    encodes += 1
+    for _ in range(4):
+        if len(low) <= max_bytes:
+            break
+        scale *= math.sqrt(max_bytes / len(low)) * 0.95
+        low = _encode(img, scale, QUALITY_MIN, fmt)
+        encodes += 1
+    else:
+        if len(low) > max_bytes:
+            return low, encodes
+    best = low
+
+    # 3) 在当前尺寸上二分查找满足大小限制的最高质量
+    img = _resize(img, scale)
+    lo, hi = QUALITY_MIN, QUALITY_MAX
+    while hi - lo > 5:
+        mid = (lo + hi) // 2
+        out = _encode(img, 1.0, mid, fmt)
+        encodes += 1
+        if len(out) <= max_bytes:
+            best, lo = out, mid
+        else:
+            hi = mid
+    return best, encodes
+
+
+def _compress_task(image_bytes: bytes, max_bytes: int, fmt: str) -> bytes:
+    try:
+        return compress_sync(image_bytes, max_bytes, fmt)[0]
+    except Exception as e:
+        raise ValueError(f"图片压缩失败: {e}")
+
+
+def configure_pool(workers: int):
+    """设置压缩进程池大小，0 表示使用默认线程池"""
+    global _pool, _pool_workers
+    if workers == _pool_workers and (_pool or not workers):
+        return
+    shutdown_pool()
+    _pool_workers = workers
+    if workers > 0:
+        # spawn 避免在已有多线程的宿主进程中 fork
+        _pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+
+def shutdown_pool():
+    global _pool
+    if _pool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def compress_image(
+    image_bytes: bytes, max_bytes: int, fmt: str = "JPEG"
+) -> bytes:
+    """
+    在进程池中压缩静态图片到指定大小以内，GIF 不处理
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool:
+        try:
+            return await loop.run_in_executor(
+                _pool, _compress_task, image_bytes, max_bytes, fmt
+            )
+        except BrokenProcessPool:
+            # 子进程异常退出时重建进程池，本次退回线程池
+            _pool = None
+            configure_pool(_pool_workers)
+    return await loop.run_in_executor(None, _compress_task, image_bytes, max_bytes, fmt)
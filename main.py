@@ -1,5 +1,4 @@
 from collections import defaultdict
-from datetime import datetime
 from astrbot.api.event import filter
 from astrbot.api import logger
 from astrbot.api.star import Context, Star, register, StarTools
@@ -57,7 +56,13 @@ class LMArenaPlugin(Star):
         # 工作流
         if self.bridge_server_url:
             self.workflow = Workflow(
-                self.conf, self.bridge_server_url, self.image_server_url
+                self.conf,
+                self.bridge_server_url,
+                self.image_server_url,
+                data_dir=self.plugin_data_dir,
+                # 内置桥梁/图床走进程内调用
+                bridge_server=self.bridge_server,
+                image_server=self.image_server,
             )
         else:
             logger.error("工作流未启动：bridge_server_url缺失")
@@ -86,23 +91,21 @@ class LMArenaPlugin(Star):
             text = self.prompt_map.get(cmd) or ""
         else:
             return
+        # 需要多样性的触发词可以排除在结果缓存之外
+        use_cache = cmd not in self.conf.get("result_cache", {}).get("exclude", [])
         images: list[bytes | str] = await self.workflow.get_images(event)
         chat_res = await self.workflow.fetch_content(
             text=text,
             images=images,
-            model="default_model",
+            model=self.conf.get("model") or "default_model",
             retries=self.conf["retries"],
+            use_cache=use_cache,
         )
 
         if isinstance(chat_res, bytes):
             yield event.chain_result([Image.fromBytes(chat_res)])
             if self.conf["save_image"]:
-                save_path = (
-                    self.file_save_dir
-                    / f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.png"
-                )
-                with save_path.open("wb") as f:
-                    f.write(chat_res)
+                await self.workflow.save_output(chat_res, self.file_save_dir)
 
         elif isinstance(chat_res, str):
             yield event.plain_result(chat_res)
@@ -112,8 +115,8 @@ class LMArenaPlugin(Star):
         event.stop_event()
 
     @filter.command("lm捕获", alias={"lmc"})
-    async def update_id(self, event: AstrMessageEvent):
-        """捕获会话ID"""
+    async def update_id(self, event: AstrMessageEvent, model: str | None = None):
+        """lm捕获 [模型名]，捕获会话ID并可标记为该模型的会话"""
         if not self.bridge_server:
             yield event.plain_result("无法操作, 当前用的不是内置LM桥梁")
             return
@@ -122,9 +125,55 @@ class LMArenaPlugin(Star):
             host=self.conf["bridge_server"]["host"],
             port=int(self.conf["bridge_server"]["port"]) + 1,
             timeout=20,
+            model=model,
         )
         yield event.plain_result(result)
 
+    @filter.command("lm会话", alias={"lms"})
+    async def lm_sessions(self, event: AstrMessageEvent):
+        """查看会话池状态"""
+        if not self.bridge_server:
+            yield event.plain_result("无法操作，当前用的不是内置 LM 桥梁")
+            return
+        stats = self.bridge_server.sessions.stats()
+        if not stats:
+            yield event.plain_result("会话池为空，请先使用 lm捕获")
+            return
+        lines = [f"【会话池】共 {len(stats)} 个"]
+        for idx, s in enumerate(stats, start=1):
+            state = "冷却中" if s["cooling"] else "可用"
+            tag = f" ({s['model']})" if s["model"] else ""
+            lines.append(
+                f"{idx}. {s['session_id'][:8]}{tag} | 在途 {s['in_flight']} | "
+                f"连续失败 {s['failures']} | {state}"
+            )
+        yield event.plain_result("\n".join(lines))
+
+    @filter.command("lm统计", alias={"lmt"})
+    async def lm_stats(self, event: AstrMessageEvent):
+        """查看请求和重试统计"""
+        if not getattr(self, "workflow", None):
+            yield event.plain_result("工作流未启动")
+            return
+        lines = ["【重试统计】", self.workflow.retry_stats.summary()]
+        if self.bridge_server and self.bridge_server.hedger.enabled:
+            h = self.bridge_server.hedger.stats()
+            lines += [
+                "【对冲请求】",
+                f"已对冲 {h['hedged']} 次，对冲胜出 {h['hedge_wins']} 次，"
+                f"因预算跳过 {h['skipped_budget']} 次 | 触发等待 {h['delay_seconds']}s",
+            ]
+        if self.bridge_server and self.bridge_server.recovery.incidents:
+            r = self.bridge_server.recovery.stats()
+            lines += [
+                "【人机验证】",
+                f"当前状态 {r['state']} | 事故 {r['incidents']} 次，刷新 {r['refreshes']} 次，"
+                f"合并的验证错误 {r['suppressed']} 次",
+                f"暂停请求 {r['parked_total']} 个，拒绝 {r['rejected']} 个 | "
+                f"降级累计 {r['degraded_seconds']}s",
+            ]
+        yield event.plain_result("\n".join(lines))
+
     @filter.command("lm模型", alias={"lmm"})
     async def lm_model(self, event: AstrMessageEvent):
         """查看 lmarena 网页上的可用模型"""
@@ -0,0 +1,187 @@
+import random
+import time
+from collections import Counter
+
+# 错误类别
+FATAL = "fatal"  # 原样重试只会得到同样的结果
+REMEDY = "remedy"  # 先补救（缩小图片、等待页面刷新）再重试
+TRANSIENT = "transient"  # 偶发错误，退避后重试
+
+# 错误码 -> 类别，未列出的错误码都按偶发错误处理
+ERROR_CLASSES = {
+    "content_rejected": FATAL,
+    "content_filter": FATAL,
+    "bad_request": FATAL,
+    "unauthorized": FATAL,
+    "session_missing": FATAL,
+    "response_too_large": FATAL,
+    "attachment_too_large": REMEDY,
+    "cloudflare_challenge": REMEDY,
+}
+
+# 错误码 -> 给用户看的提示
+ERROR_MESSAGES = {
+    "content_rejected": "内容不合规",
+    "attachment_too_large": "图片过大，压缩后仍超过 LMArena 的限制",
+}
+
+
+class FetchError(Exception):
+    """
+    一次请求的失败：错误码决定能否重试，retry_after 为服务端建议的等待秒数
+    """
+
+    def __init__(
+        self,
+        message: str,
+        code: str = "processing_error",
+        retry_after: float | None = None,
+    ):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+
+    @property
+    def kind(self) -> str:
+        return ERROR_CLASSES.get(self.code, TRANSIENT)
+
+    @property
+    def user_message(self) -> str:
+        return ERROR_MESSAGES.get(self.code) or str(self)
+
+    @classmethod
+    def from_response(
+        cls, status: int, body, retry_after: float | None = None
+    ) -> "FetchError":
+        """
+        由桥梁的错误响应构造；旧版桥梁和 FastAPI 的 {"detail": ...} 没有错误码，
+        按状态码和错误文案推断
+        """
+        message, code = str(body), None
+        if isinstance(body, dict):
+            error = body.get("error")
+            if isinstance(error, dict):
+                message = error.get("message") or message
+                code = error.get("code")
+                retry_after = error.get("retry_after", retry_after)
+            elif body.get("detail"):
+                message = str(body["detail"])
+        if not code or code == "processing_error":
+            code = _guess_code(status, message)
+        return cls(message, code, retry_after)
+
+
+def _guess_code(status: int, message: str) -> str:
+    if "422" in message:
+        return "content_rejected"
+    if "cloudflare" in message.lower():
+        return "cloudflare_challenge"
+    return {
+        400: "bad_request",
+        401: "unauthorized",
+        403: "unauthorized",
+        413: "attachment_too_large",
+        429: "overloaded",
+        503: "unavailable",
+    }.get(status, "processing_error")
+
+
+class RetryPolicy:
+    """
+    重试策略：次数、带抖动的指数退避和总时限
+    """
+
+    def __init__(
+        self,
+        retries: int,
+        base_delay: float = 1,
+        max_delay: float = 30,
+        deadline: float = 0,
+    ):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # 从第一次请求开始计时的总时限（秒），0 表示不限制
+        self.deadline = deadline
+
+    @classmethod
+    def from_conf(cls, conf, model: str, retries: int) -> "RetryPolicy":
+        """
+        读取 retry_policy 配置；models 中的 "模型名:重试次数[:总时限]"
+        按模型名前缀（忽略大小写）覆盖默认值
+        """
+        policy_conf = conf.get("retry_policy", {})
+        deadline = policy_conf.get("deadline", 0)
+        for item in policy_conf.get("models", []):
+            name, _, rest = item.partition(":")
+            if not rest or not model.lower().startswith(name.strip().lower()):
+                continue
+            values = rest.split(":")
+            try:
+                retries = int(values[0])
+                if len(values) > 1:
+                    deadline = float(values[1])
+            except ValueError:
+                continue
+            break
+        return cls(
+            retries,
+            base_delay=policy_conf.get("base_delay", 1),
+            max_delay=policy_conf.get("max_delay", 30),
+            deadline=deadline,
+        )
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """第 attempt 次失败后的等待时间：全抖动指数退避，不少于服务端建议的时间"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after:
+            delay = max(delay, float(retry_after))
+        return delay
+
+    def remaining(self, started: float) -> float | None:
+        """距总时限剩余的秒数，不限制时返回 None"""
+        if self.deadline <= 0:
+            return None
+        return self.deadline - (time.monotonic() - started)
+
+
+class RetryStats:
+    """
+    重试统计：有效重试（最终成功的那次重试）、浪费的重试（重试后仍失败）、
+    以及因错误不可重试或超出时限而省下的重试
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.first_try = 0
+        self.succeeded = 0
+        self.useful = 0
+        self.wasted = 0
+        self.skipped = 0
+        self.remedies = 0
+        self.errors: Counter[str] = Counter()
+
+    def record_success(self, attempt: int):
+        self.succeeded += 1
+        if attempt:
+            self.useful += 1
+        else:
+            self.first_try += 1
+
+    def record_failure(self, error: FetchError, attempt: int):
+        self.errors[error.code] += 1
+        if attempt:
+            self.wasted += 1
+
+    def summary(self) -> str:
+        lines = [
+            f"请求 {self.requests} | 成功 {self.succeeded}（首次即成功 {self.first_try}）",
+            f"重试 {self.useful + self.wasted} 次：有效 {self.useful} | 浪费 {self.wasted}",
+            f"补救后重试 {self.remedies} 次 | 省下的重试 {self.skipped} 次",
+        ]
+        if self.errors:
+            lines.append(
+                "错误: "
+                + "，".join(f"{code}×{n}" for code, n in self.errors.most_common())
+            )
+        return "\n".join(lines)
@@ -1,87 +1,35 @@
 import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime
 import mimetypes
 from random import random
 import re
 import base64
+import io
+import time
 from pathlib import Path
 from typing import Optional
-import uuid
+from urllib.parse import urlparse
 import aiohttp
 from astrbot.api import logger
 from astrbot.core.config.astrbot_config import AstrBotConfig
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 import astrbot.core.message.components as Comp
-import io
-from PIL import Image
-
-
-def extract_first_frame(raw: bytes) -> bytes:
-    """把 GIF 的第一帧抽出来，返回 PNG/JPEG 字节流"""
-    img_io = io.BytesIO(raw)
-    img = Image.open(img_io)
-    if img.format != "GIF":
-        return raw  # 不是 GIF，原样返回
-    first_frame = img.convert("RGBA")
-    out_io = io.BytesIO()
-    first_frame.save(out_io, format="PNG")
-    return out_io.getvalue()
-
-
-async def compress_image(image_bytes: bytes, max_bytes: int) -> bytes:
-    """
-    线程池里压缩静态图片到指定大小以内，GIF 不处理
-    """
-    loop = asyncio.get_running_loop()
-
-    def _inner(image_bytes: bytes, max_bytes: int) -> bytes:
-        try:
-            img = Image.open(io.BytesIO(image_bytes))
-
-            # GIF 不处理
-            if img.format == "GIF":
-                return image_bytes
-
-            if len(image_bytes) <= max_bytes:
-                return image_bytes
-
-            # 2) 先把长边一次性缩到 1024 以下，质量先压到 70
-            img.thumbnail((1024, 1024), Image.LANCZOS)  # type: ignore
-            resampled = io.BytesIO()
-            img.save(resampled, format=img.format, quality=70, optimize=True)
-            resampled.seek(0)
-            if resampled.tell() <= max_bytes:
-                return resampled.getvalue()
-
-            # 3) 还不够小，再进入原有循环微调
-            quality, scale = 50, 0.6
-            resample = Image.LANCZOS  # type: ignore
-
-            while True:
-                resampled.seek(0)
-                resampled.truncate(0)
-
-                if scale < 1:
-                    w, h = img.size
-                    tmp = img.resize((int(w * scale), int(h * scale)), resample)
-                else:
-                    tmp = img
-
-                tmp.save(resampled, format=img.format, quality=quality, optimize=True)
-
-                if resampled.tell() <= max_bytes or (quality <= 5 and scale <= 0.2):
-                    break
-
-                if quality > 5:
-                    quality -= 5
-                else:
-                    scale *= 0.9
-
-            return resampled.getvalue()
-
-        except Exception as e:
-            raise ValueError(f"图片压缩失败: {e}")
-
-    return await loop.run_in_executor(None, _inner, image_bytes, max_bytes)
+from .bridge.server import LMArenaBridgeServer
+from .file_bed import ImageServer
+from .cache import ImagePrepCache, ResultCache, content_digest
+from .imaging import (
+    compress_image,
+    configure_pool,
+    extract_first_frame,
+    shutdown_pool,
+    sniff_mime,
+)
+from .retry import FATAL, REMEDY, FetchError, RetryPolicy, RetryStats
+
+# 请求中每张图片的大小上限；LMArena 报告附件过大时逐次减半，直到下限
+DEFAULT_MAX_IMAGE_BYTES = 3_500_000
+MIN_MAX_IMAGE_BYTES = 500_000
 
 
 class Workflow:
@@ -92,52 +40,133 @@ class Workflow:
     headers = {"Content-Type": "application/json"}
 
     def __init__(
-        self, config: AstrBotConfig, bridge_server_url: str, image_server_url: str | None
+        self,
+        config: AstrBotConfig,
+        bridge_server_url: str,
+        image_server_url: str | None,
+        data_dir: Path | None = None,
+        bridge_server: "LMArenaBridgeServer | None" = None,
+        image_server: "ImageServer | None" = None,
     ):
+        """
+        bridge_server / image_server: 插件内置的桥梁和图床，
+        传入时直接调用，不再走本机 HTTP；为 None 时通过 URL 访问远程服务
+        """
         self.conf = config
         self.bridge_server_url = bridge_server_url
         self.image_server_url = image_server_url
+        self.bridge_server = bridge_server
+        self.image_server = image_server
         self.session = aiohttp.ClientSession()
+        # 图床是否支持二进制上传，None 表示尚未探测
+        self._raw_upload: bool | None = None
+
+        # 结果缓存(可选)
+        self.result_cache: ResultCache | None = None
+        cache_conf = self.conf.get("result_cache", {})
+        if cache_conf.get("enabled") and data_dir:
+            self.result_cache = ResultCache(
+                data_dir / "result_cache",
+                ttl=cache_conf.get("ttl_hours", 24) * 3600,
+                memory_items=cache_conf.get("memory_items", 64),
+                memory_bytes=cache_conf.get("memory_mb", 64) * 1024 * 1024,
+                disk_bytes=cache_conf.get("disk_mb", 256) * 1024 * 1024,
+            )
+        # 输入图片预处理缓存：复用抽帧/压缩结果和图床 URL
+        # 图床 URL 提前 10 分钟视为过期，避免恰好在清理时被使用
+        clear_hours = self.conf.get("image_server", {}).get("clear_cache_interval", 0)
+        self.prep_cache = ImagePrepCache(
+            max_bytes=self.conf.get("image_prep_cache_mb", 64) * 1024 * 1024,
+            url_ttl=max(clear_hours * 3600 - 600, 60) if clear_hours else 0,
+        )
+        # 图片压缩进程池
+        configure_pool(self.conf.get("compress_workers", 2))
+        # 重试统计
+        self.retry_stats = RetryStats()
+
+    def _image_digest(self, img: bytes | str) -> str:
+        if isinstance(img, str) and (digest := self.prep_cache.url_digest(img)):
+            return digest
+        return content_digest(img)
+
+    async def _post_upload(self, url: str, **kwargs) -> tuple[int, str | None]:
+        """向图床发起上传，返回 (HTTP 状态码, 文件名)"""
+        async with self.session.post(url, **kwargs) as response:
+            if response.status >= 400:
+                error_text = await response.text()
+                if response.status not in (404, 405):
+                    logger.error(
+                        f"上传到文件床时发生 HTTP 错误: {response.status} - {error_text}"
+                    )
+                return response.status, None
+
+            result = await response.json(content_type=None)
+            if not (result.get("success") and result.get("filename")):
+                logger.error(f"图床上传失败: {result.get('error', '未知错误')}")
+                return response.status, None
+            return response.status, result["filename"]
 
-    async def upload_to_bed(self, img_bytes: bytes, image_server_url: str) -> str | None:
+    async def upload_to_bed(
+        self, img_bytes: bytes, image_server_url: str
+    ) -> str | None:
         """
-        转 base64 并上传到图床，返回可访问的 URL。
+        上传到图床，返回可访问的 URL。
+        优先以原始二进制上传（/upload/raw），图床不支持时回退到 base64 JSON 上传
         """
+        # 只填了 host:port 时补全上传路径
+        if urlparse(image_server_url).path in ("", "/"):
+            image_server_url = image_server_url.rstrip("/") + "/upload"
         try:
             # 自动生成文件名（确保唯一）
-            file_name = f"{uuid.uuid4().hex}.jpg"
-            mime_type = mimetypes.guess_type(file_name)[0] or "image/jpeg"
-
-            # 转 Base64
-            base64_str = base64.b64encode(img_bytes).decode()
-            data_uri = f"data:{mime_type};base64,{base64_str}"
-
+            mime_type = sniff_mime(img_bytes)
+            if not mime_type.startswith("image/"):
+                mime_type = "image/jpeg"
+            ext = mimetypes.guess_extension(mime_type) or ".jpg"
+            digest = content_digest(img_bytes)
+            # 按内容命名，图床可以据此去重
+            file_name = f"{digest}{ext}"
             api_key = self.conf["image_server"]["api_key"]
-            payload = {
-                "file_name": file_name,
-                "file_data": data_uri,
-                "api_key": api_key,
-            }
 
-            async with self.session.post(
-                url=image_server_url, json=payload
-            ) as response:
-                if response.status >= 400:
-                    error_text = await response.text()
-                    logger.error(
-                        f"上传到文件床时发生 HTTP 错误: {response.status} - {error_text}"
-                    )
-                    return None
-
-                result = await response.json()
-                if not (result.get("success") and result.get("filename")):
-                    logger.error(f"图床上传失败: {result.get('error', '未知错误')}")
-                    return None
-                # 拼接 URL
-                url_prefix = image_server_url.rsplit("/", 1)[0]
-                uploaded_url = f"{url_prefix}/uploads/{result['filename']}"
-                logger.info(f"图片成功上传到图床: {uploaded_url}")
-                return uploaded_url
+            filename = None
+            if self.image_server:
+                # 内置图床：直接写入上传目录
+                filename = await asyncio.to_thread(
+                    self.image_server.save_upload, img_bytes
+                )
+            elif self._raw_upload is not False:
+                status, filename = await self._post_upload(
+                    f"{image_server_url}/raw",
+                    data=img_bytes,
+                    headers={
+                        "Content-Type": mime_type,
+                        "X-API-Key": api_key,
+                        "X-Content-SHA256": digest,
+                    },
+                )
+                if status in (404, 405):
+                    logger.info("图床不支持二进制上传，改用 base64 上传")
+                    self._raw_upload = False
+                elif status < 400:
+                    self._raw_upload = True
+
+            if not self.image_server and self._raw_upload is False:
+                # 转 Base64
+                base64_str = base64.b64encode(img_bytes).decode()
+                data_uri = f"data:{mime_type};base64,{base64_str}"
+                payload = {
+                    "file_name": file_name,
+                    "file_data": data_uri,
+                    "api_key": api_key,
+                }
+                _, filename = await self._post_upload(image_server_url, json=payload)
+
+            if not filename:
+                return None
+            # 拼接 URL
+            url_prefix = image_server_url.rsplit("/", 1)[0]
+            uploaded_url = f"{url_prefix}/uploads/{filename}"
+            logger.info(f"图片成功上传到图床: {uploaded_url}")
+            return uploaded_url
 
         except aiohttp.ClientResponseError as e:
             logger.error(f"上传到文件床时发生 HTTP 响应错误: {e.status} - {e.message}")
@@ -148,17 +177,56 @@ class Workflow:
 
         return None
 
-    async def _download_image(self, url: str, http: bool = True) -> bytes | None:
-        """下载图片"""
+    async def _download_image(
+        self, url: str, http: bool = True, check_type: bool = False
+    ) -> bytes | None:
+        """
+        分块下载图片，超过 max_download_mb 时中止
+        check_type: 校验 Content-Type 是否为图片（用于模型生成的结果）
+        """
         if http:
             url = url.replace("https://", "http://")
+        max_bytes = self.conf.get("max_download_mb", 20) * 1024 * 1024
         try:
             async with self.session.get(url) as resp:
-                return await resp.read()
+                if resp.status >= 400:
+                    logger.error(f"图片下载失败: HTTP {resp.status}")
+                    return None
+                ctype = resp.content_type
+                if check_type and not (
+                    ctype.startswith("image/") or ctype == "application/octet-stream"
+                ):
+                    logger.error(f"图片下载失败: 不是图片 ({ctype})")
+                    return None
+                if max_bytes and (resp.content_length or 0) > max_bytes:
+                    logger.error(f"图片下载失败: 大小 {resp.content_length} 超过上限")
+                    return None
+                # 每个数据块写入后即可释放；getvalue() 直接交出内部缓冲区，
+                # 不像 b"".join 那样在拼接时同时持有两份完整数据
+                buf = io.BytesIO()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    if max_bytes and buf.tell() + len(chunk) > max_bytes:
+                        logger.error(f"图片下载失败: 超过 {max_bytes} 字节上限")
+                        return None
+                    buf.write(chunk)
+                return buf.getvalue()
         except Exception as e:
             logger.error(f"图片下载失败: {e}")
             return None
 
+    async def save_output(self, data: bytes, save_dir: Path) -> Path | None:
+        """在线程中把生成的图片写入 save_dir，不阻塞事件循环"""
+        mime = sniff_mime(data)
+        ext = mimetypes.guess_extension(mime) if mime.startswith("image/") else None
+        file_name = datetime.now().strftime("%Y%m%d_%H%M%S_%f") + (ext or ".png")
+        save_path = save_dir / file_name
+        try:
+            await asyncio.to_thread(save_path.write_bytes, data)
+            return save_path
+        except OSError as e:
+            logger.error(f"保存图片失败: {e}")
+            return None
+
     async def _get_avatar(self, user_id: str) -> bytes | None:
         """根据 QQ 号下载头像"""
         if not user_id.isdigit():
@@ -180,77 +248,128 @@ class Workflow:
             return base64.b64decode(src[9:])
         if not raw:
             return None
-        # 抽 GIF 第一帧
-        return extract_first_frame(raw)
+        # 抽 GIF 第一帧（解码较重，放到线程中）
+        return await asyncio.to_thread(extract_first_frame, raw)
 
-    async def _extract_from_segments(
+    async def _prepare_image(
+        self, source: str | None, loader: Callable[[], Awaitable[bytes | None]]
+    ) -> bytes | str | None:
+        """
+        取得可直接发送的图片（图床 URL 或 bytes），优先复用预处理缓存。
+        source: 图片来源标识（URL、头像），命中时连下载都可以省掉
+        """
+        item = None
+        if source and (digest := self.prep_cache.source_digest(source)):
+            item = self.prep_cache.get(digest)
+        if not item:
+            raw = await loader()
+            if not raw:
+                return None
+            digest = content_digest(raw)
+            if source:
+                self.prep_cache.remember_source(source, digest)
+            item = self.prep_cache.get(digest) or self.prep_cache.put(digest, raw)
+
+        if not self.image_server_url:
+            return item.data
+        url = item.valid_url()
+        # 内置图床可能已按容量淘汰该文件
+        if url and self.image_server:
+            url = url if self.image_server.has_upload(url.rsplit("/", 1)[-1]) else None
+        if url:
+            return url
+        if url := await self.upload_to_bed(item.data, self.image_server_url):
+            self.prep_cache.set_url(item, url)
+            return url
+        logger.warning("图床上传失败，回退到 base64")
+        return item.data
+
+    def _collect_from_segments(
         self, segments: list, event: AstrMessageEvent
-    ) -> list[bytes | str]:
-        """从消息片段中提取图片或头像，支持图床失败回退到 base64"""
-        results: list[bytes | str] = []
+    ) -> list[tuple[str | None, Callable[[], Awaitable[bytes | None]]]]:
+        """从消息片段中收集图片或头像的 (来源, 加载函数)"""
+        jobs = []
         for seg in segments:
             # 处理图片
             if isinstance(seg, Comp.Image):
                 if src := seg.url or seg.file:
-                    if img_bytes := await self._load_bytes(src):
-                        if self.image_server_url:
-                            if url := await self.upload_to_bed(
-                                img_bytes, self.image_server_url
-                            ):
-                                results.append(url)
-                            else:
-                                logger.warning("图床上传失败，回退到 base64")
-                                results.append(img_bytes)
-                        else:
-                            results.append(img_bytes)
+                    source = src if src.startswith("http") else None
+                    jobs.append((source, lambda src=src: self._load_bytes(src)))
 
             # 处理@用户头像
             elif isinstance(seg, Comp.At) and str(seg.qq) != event.get_self_id():
-                avatar = await self._get_avatar(str(seg.qq))
-                if isinstance(avatar, bytes):
-                    if self.image_server_url:
-                        if url := await self.upload_to_bed(
-                            avatar, self.image_server_url
-                        ):
-                            results.append(url)
-                        else:
-                            logger.warning("头像上传图床失败，回退到 base64")
-                            results.append(avatar)
-                    else:
-                        results.append(avatar)
-
-        return results
+                qq = str(seg.qq)
+                jobs.append((f"avatar:{qq}", lambda qq=qq: self._get_avatar(qq)))
 
-    async def get_images(self, event: AstrMessageEvent) -> list[bytes | str]:
-        """收集消息和引用里的所有图片/头像"""
-        images: list[bytes | str] = []
+        return jobs
 
+    async def get_images(self, event: AstrMessageEvent) -> list[bytes | str]:
+        """
+        收集消息和引用里的所有图片/头像，支持图床失败回退到 base64。
+        各图片并发下载、抽帧、上传，单张超时或失败会被跳过，结果保持原顺序
+        """
+        jobs = []
         # 1. 引用消息
         reply_seg = next(
             (s for s in event.get_messages() if isinstance(s, Comp.Reply)), None
         )
         if reply_seg and reply_seg.chain:
-            images.extend(await self._extract_from_segments(reply_seg.chain, event))
+            jobs.extend(self._collect_from_segments(reply_seg.chain, event))
 
         # 2. 当前消息
-        images.extend(await self._extract_from_segments(event.get_messages(), event))
-        return images
+        jobs.extend(self._collect_from_segments(event.get_messages(), event))
+        if not jobs:
+            return []
+
+        sem = asyncio.Semaphore(max(1, self.conf.get("image_fetch_concurrency", 4)))
+        timeout = self.conf.get("image_fetch_timeout", 15) or None
+
+        async def run(source, loader) -> bytes | str | None:
+            async with sem:
+                try:
+                    return await asyncio.wait_for(
+                        self._prepare_image(source, loader), timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"图片处理超时，已跳过: {source or '本地图片'}")
+                except Exception as e:
+                    logger.error(f"图片处理失败，已跳过: {e}")
+                return None
+
+        results = await asyncio.gather(*(run(src, loader) for src, loader in jobs))
+        return [img for img in results if img]
+
+    async def _compress(self, img: bytes, max_bytes: int) -> bytes:
+        """压缩图片，同一张图的压缩结果会被缓存"""
+        digest = content_digest(img)
+        item = self.prep_cache.get(digest) or self.prep_cache.put(digest, img)
+        if cached := item.compressed.get(max_bytes):
+            return cached
+        fmt = self.conf.get("compress_format", "jpeg")
+        compressed = await compress_image(img, max_bytes, fmt)
+        self.prep_cache.set_compressed(item, max_bytes, compressed)
+        return compressed
 
-    @staticmethod
     async def make_openai_req(
-        text: str, images: list[bytes | str] | None, model: str
+        self,
+        text: str,
+        images: list[bytes | str] | None,
+        model: str,
+        max_bytes: int = DEFAULT_MAX_IMAGE_BYTES,
     ) -> dict:
         """
         制作 OpenAI 格式数据块，支持多张图片
         - images 可为单个 bytes/str，也可为 list
+        - max_bytes: 每张图片压缩后的大小上限
         """
         content: list[dict] = [{"type": "text", "text": text}]
 
         if images:
             for img in images:
                 if isinstance(img, bytes):
-                    compressed = await compress_image(img, 3_500_000)
-                    img_url = f"data:image/jpeg;base64,{base64.b64encode(compressed).decode()}"
+                    compressed = await self._compress(img, max_bytes)
+                    mime_type = sniff_mime(compressed)
+                    img_url = f"data:{mime_type};base64,{base64.b64encode(compressed).decode()}"
                 elif isinstance(img, str):
                     img_url = img
                 else:
@@ -275,56 +394,150 @@ class Workflow:
         images: list[bytes | str] | None,
         model: str,
         retries: int = 3,
+        use_cache: bool = True,
     ) -> bytes | str | None:
         """
-        发送请求并返回图片 bytes；
-        失败时重试 retries 次，最后一次仍失败则返回错误字符串。
+        发送请求并返回图片 bytes 或文本；
+        按错误类别决定是否重试：不可重试的错误直接返回，需要补救的错误
+        （图片过大、Cloudflare 验证）补救后再试，其余错误带抖动退避重试。
+        重试次数和总时限见 retry_policy 配置，失败时返回错误字符串。
+        use_cache: 是否使用结果缓存（需在配置中启用）
         """
-        openai_req = await self.make_openai_req(text, images, model)
+        cache_key = None
+        if self.result_cache and use_cache:
+            cache_key = ResultCache.make_key(
+                model, text, [self._image_digest(img) for img in images or []]
+            )
+            if cached := await self.result_cache.get(cache_key):
+                logger.info(f"命中结果缓存: {text[:50]}...")
+                return cached
+
+        policy = RetryPolicy.from_conf(self.conf, model, retries)
+        stats = self.retry_stats
+        stats.requests += 1
+        started = time.monotonic()
+        max_bytes = DEFAULT_MAX_IMAGE_BYTES
+        try:
+            openai_req = await self.make_openai_req(text, images, model, max_bytes)
+        except ValueError as e:
+            # 图片无法解码或压缩，重试也没有用
+            logger.error(f"构造请求失败: {e}")
+            return str(e)
         logger.debug(openai_req)
-        url = f"{self.bridge_server_url}/v1/chat/completions"
-        error_msg = None  # 记录最后一次的错误信息
-        for attempt in range(retries + 1):
+
+        attempt = 0
+        while True:
             logger.info(f"请求{model}(第 {attempt + 1} 次): {text[:50]}...")
             try:
-                async with self.session.post(
-                    url, headers=self.headers, json=openai_req
-                ) as resp:
-                    result = await resp.json()
-                    logger.debug(result)
-                    if resp.status != 200:
-                        error_msg = result.get("error", {}).get("message") or str(
-                            result
-                        )
-                        if "422" in error_msg:
-                            error_msg = "内容不合规"
-                        raise ValueError(error_msg)  # 触发重试
-
-                    # HTTP 200，尝试解析图片 URL
-                    content_msg = result["choices"][0]["message"]["content"]
-                    if match := re.search(r"!\[.*?\]\((.*?)\)", content_msg):
-                        img_url = match.group(1)
-                        logger.info(f"返回图片 URL: {img_url}")
-                        img = await self._download_image(img_url, http=False)
-                        if not img:
-                            error_msg = "图片下载失败"
-                            raise ValueError("图片下载失败")  # 触发重试
-                        return img
-                    elif content_msg:
-                        return content_msg
-                    else:
-                        error_msg = "响应为空"
-                        raise ValueError(error_msg)
-
+                result = await self._request_once(openai_req)
+            except FetchError as e:
+                error = e
             except Exception as e:
-                logger.error(f"第 {attempt + 1} 次失败: {e}")
-                if attempt < retries:
-                    await asyncio.sleep(2**attempt)
-                # 最后一次循环继续，不会提前 return
-
-        # 走到这里说明所有重试机会已用完
-        return error_msg or "unknown error"
+                error = FetchError(str(e) or type(e).__name__, "network_error")
+            else:
+                stats.record_success(attempt)
+                if cache_key and self.result_cache:
+                    await self.result_cache.put(cache_key, result)
+                return result
+
+            stats.record_failure(error, attempt)
+            logger.error(f"第 {attempt + 1} 次失败 [{error.code}]: {error}")
+            if attempt >= policy.retries:
+                break
+            if error.kind == FATAL:
+                logger.info(f"{error.code} 重试也不会成功，不再重试")
+                stats.skipped += policy.retries - attempt
+                break
+
+            delay = policy.backoff(attempt, error.retry_after)
+            remaining = policy.remaining(started)
+            if remaining is not None and remaining <= delay:
+                logger.info("已到重试总时限，不再重试")
+                stats.skipped += policy.retries - attempt
+                break
+
+            if error.kind == REMEDY:
+                if error.code == "attachment_too_large":
+                    # 缩小图片后重新构造请求
+                    if max_bytes <= MIN_MAX_IMAGE_BYTES or not any(
+                        isinstance(img, bytes) for img in images or []
+                    ):
+                        stats.skipped += policy.retries - attempt
+                        break
+                    max_bytes = max(MIN_MAX_IMAGE_BYTES, max_bytes // 2)
+                    logger.info(f"图片过大，压缩到 {max_bytes // 1000}KB 以内后重试")
+                    try:
+                        openai_req = await self.make_openai_req(
+                            text, images, model, max_bytes
+                        )
+                    except ValueError as e:
+                        logger.error(f"重新压缩图片失败: {e}")
+                        stats.skipped += policy.retries - attempt
+                        break
+                elif error.code == "cloudflare_challenge":
+                    wait = self.conf.get("retry_policy", {}).get("cloudflare_wait", 20)
+                    if remaining is not None:
+                        wait = min(wait, remaining - delay)
+                    await self._wait_for_browser(wait)
+                stats.remedies += 1
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        return error.user_message
+
+    async def _request_once(self, openai_req: dict) -> bytes | str:
+        """发送一次请求，成功返回图片 bytes 或文本，失败抛出 FetchError"""
+        if self.bridge_server and self.bridge_server.loop:
+            # 内置桥梁：直接提交到桥梁的事件循环，不经过 HTTP
+            status, result = await self.bridge_server.complete_threadsafe(openai_req)
+            retry_after = None
+        else:
+            url = f"{self.bridge_server_url}/v1/chat/completions"
+            async with self.session.post(
+                url, headers=self.headers, json=openai_req
+            ) as resp:
+                status, result = resp.status, await resp.json(content_type=None)
+                retry_after = resp.headers.get("Retry-After")
+        logger.debug(result)
+        if status != 200:
+            raise FetchError.from_response(
+                status, result, float(retry_after) if retry_after else None
+            )
+
+        # HTTP 200，尝试解析图片 URL
+        choice = result["choices"][0]
+        content_msg = choice["message"]["content"]
+        if choice.get("finish_reason") == "content-filter":
+            raise FetchError(content_msg or "响应被过滤", "content_filter")
+        if match := re.search(r"!\[.*?\]\((.*?)\)", content_msg):
+            img_url = match.group(1)
+            logger.info(f"返回图片 URL: {img_url}")
+            img = await self._download_image(img_url, http=False, check_type=True)
+            if not img:
+                raise FetchError("图片下载失败", "download_failed")
+            return img
+        if content_msg:
+            return content_msg
+        raise FetchError("响应为空", "empty_response")
+
+    async def _wait_for_browser(self, timeout: float):
+        """Cloudflare 验证后等待标签页刷新并重新连上桥梁"""
+        if timeout <= 0:
+            return
+        if not self.bridge_server:
+            await asyncio.sleep(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        # 桥梁在收到验证错误时已进入恢复状态，等到标签页重连、开始探测；
+        # 之后的请求由桥梁暂停或作为探测放行
+        recovery = self.bridge_server.recovery
+        while time.monotonic() < deadline:
+            if recovery.state != "open" and self.bridge_server.workers.healthy_count():
+                return
+            await asyncio.sleep(0.5)
 
     async def terminate(self):
         if self.session:
             await self.session.close()
+        shutdown_pool()